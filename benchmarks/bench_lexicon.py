@@ -0,0 +1,86 @@
+"""Benchmark text normalization as the lexicon grows.
+
+Compares the one pass Normalizer of redtts.speech.lexicon against running
+str.replace once per lexicon entry, on lexicons of made up acronyms.
+
+python benchmarks/bench_lexicon.py --sizes 16,256,4096
+"""
+from typing import Dict
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import redtts.speech.lexicon as lexicon  # noqa: E402
+
+
+def legacy_normalize(text: str, words: Dict[str, str]) -> str:
+    """The str.replace per entry normalization the Normalizer replaced."""
+    for k, v in words.items():
+        text = text.replace(k, v)
+    return text
+
+
+def make_lexicon(size: int, seed=0) -> Dict[str, str]:
+    """Make a lexicon of random upper case acronyms."""
+    rng = random.Random(seed)
+    words = {}
+    while len(words) < size:
+        word = "".join(
+            rng.choice(string.ascii_uppercase)
+            for _ in range(rng.randint(3, 6))
+        )
+        words[word] = " ".join(word.lower())
+    return words
+
+
+def make_sentences(words: Dict[str, str], count: int, seed=0):
+    """Make sentences of plain words with an acronym now and then."""
+    rng = random.Random(seed)
+    acronyms = list(words)
+    sentences = []
+    for _ in range(count):
+        sentence = [
+            rng.choice(acronyms) if rng.random() < 0.1 else "word"
+            for _ in range(15)
+        ]
+        sentences.append(" ".join(sentence) + ".")
+    return sentences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark normalization.')
+    parser.add_argument('--sizes', default='16,256,4096',
+                        help='Comma separated lexicon sizes.')
+    parser.add_argument('--sentences', default=300, type=int,
+                        help='Number of sentences normalized per run.')
+    parser.add_argument('--repeat', default=5, type=int,
+                        help='Number of timed runs, the best is reported.')
+    args = parser.parse_args()
+
+    print("%8s %12s %12s %12s" % ("entries", "compile ms", "legacy ms",
+                                  "one pass ms"))
+    for size in map(int, args.sizes.split(",")):
+        words = make_lexicon(size)
+        sentences = make_sentences(words, args.sentences)
+        start = timeit.default_timer()
+        normalizer = lexicon.Normalizer(words)
+        compile_time = timeit.default_timer() - start
+        legacy = min(timeit.repeat(
+            lambda: [legacy_normalize(s, words) for s in sentences],
+            number=1, repeat=args.repeat
+        ))
+        one_pass = min(timeit.repeat(
+            lambda: [normalizer.normalize(s) for s in sentences],
+            number=1, repeat=args.repeat
+        ))
+        print("%8d %12.2f %12.2f %12.2f" % (
+            size, compile_time * 1000, legacy * 1000, one_pass * 1000
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""Benchmark every stage of making a video, offline.
+
+Runs synthetic submissions through tokenizing, curating comment chains,
+rendering, speech, stitching, compiling and adding music, and reports the
+throughput of each stage. Submissions are generated locally and speech comes
+from a stub voice bot writing tones whose length follows the text, so no
+network, reddit credentials or text to speech voice are needed, only ffmpeg.
+Frames are rendered by run_reddit_man.render_frames, written to disk or,
+with --pipeline, streamed in memory, so the numbers follow the real code
+path.
+
+Scenarios:
+    short: A short post.
+    aita: A long AITA post, 300 sentences by default.
+    thread: A short post followed by comment chains curated from a huge
+        comment thread.
+
+python benchmarks/bench_pipeline.py --scenarios short,aita --backend ffmpeg
+"""
+from typing import Dict, Iterable, Iterator, List
+import argparse
+import math
+import os
+import random
+import shutil
+import struct
+import sys
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import redtts.instrument as instrument  # noqa: E402
+import redtts.pipeline as pipeline  # noqa: E402
+import redtts.reddit.reddit as r  # noqa: E402
+import redtts.utils as utils  # noqa: E402
+import redtts.video.stitcher as stitch  # noqa: E402
+import run_reddit_man  # noqa: E402
+from redtts.reddit.store import StoredSubmission  # noqa: E402
+from redtts.sentence import Sentence  # noqa: E402
+
+
+SCENARIOS = ["short", "aita", "thread"]
+
+WIDTH = 1920
+HEIGHT = 1080
+FPS = 2
+
+WORDS = [
+    "the", "landlord", "never", "fixed", "my", "sink", "so", "I", "told",
+    "him", "that", "his", "tenants", "would", "be", "moving", "out", "next",
+    "month", "and", "honestly", "it", "was", "worth", "every", "penny",
+    "Mr.", "Smith", "e.g.", "revenge", "neighbour", "car", "parking", "spot"
+]
+
+
+class StubVoiceBot(object):
+    """Voice bot writing tones instead of speech.
+
+    Every sentence gets a WAV file whose length is proportional to its text,
+    so stitching sees realistic durations without a text to speech engine.
+    """
+
+    def __init__(self, seconds_per_character=0.06, sample_rate=22050,
+                 tone=True):
+        """ Initialize stub voice bot.
+
+        Args:
+            seconds_per_character: Length of audio per character of text.
+            sample_rate: Sample rate of the audio files.
+            tone: Whether to write a tone, silence otherwise.
+        """
+        super(StubVoiceBot, self).__init__()
+        self.seconds_per_character = seconds_per_character
+        self.sample_rate = sample_rate
+        period = [0] * 50
+        if tone:
+            period = [
+                int(8000 * math.sin(2 * math.pi * i / 50)) for i in range(50)
+            ]
+        # One 50 sample period of the tone, repeated to any length.
+        self.period = struct.pack("<%dh" % len(period), *period)
+
+    def _write(self, text: str, filename: str):
+        """Write the audio of a sentence."""
+        num_samples = max(1, int(
+            len(text) * self.seconds_per_character * self.sample_rate
+        ))
+        num_periods = num_samples // 50 + 1
+        with wave.open(filename, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sample_rate)
+            f.writeframes((self.period * num_periods)[:num_samples * 2])
+
+    def _audio_filename(self, sentence: Sentence, filepath: str) -> str:
+        return filepath + "/recording_%s.wav" % sentence.index
+
+    def generate_speech_files(self, sentences: List[Sentence], filepath: str,
+                              submission,
+                              include_intro=False) -> List[Sentence]:
+        """Write audio for every sentence, like VoiceBot.
+
+        Args:
+            sentences: Sentences to be translated.
+            filepath: Where to store the audio files.
+            submission: Unused, for compatibility with VoiceBot.
+            include_intro: Unused, for compatibility with VoiceBot.
+        Returns:
+            The given sentences, with their audio set.
+        """
+        if not os.path.exists(filepath):
+            os.makedirs(filepath)
+        for sentence in sentences:
+            sentence.audio = self._audio_filename(sentence, filepath)
+            self._write(sentence.text, sentence.audio)
+        return sentences
+
+    def iter_speech_files(self, sentences: Iterable[Sentence], filepath: str,
+                          submission,
+                          include_intro=False) -> Iterator[Sentence]:
+        """Write audio for sentences as they arrive, like VoiceBot.
+
+        Args:
+            sentences: Sentences to be translated, may be a generator.
+            filepath: Where to store the audio files.
+            submission: Unused, for compatibility with VoiceBot.
+            include_intro: Unused, for compatibility with VoiceBot.
+        Yields:
+            The given sentences, with their audio set.
+        """
+        if not os.path.exists(filepath):
+            os.makedirs(filepath)
+        for sentence in sentences:
+            sentence.audio = self._audio_filename(sentence, filepath)
+            self._write(sentence.text, sentence.audio)
+            yield sentence
+
+    def close(self):
+        pass
+
+
+def make_text(rng: random.Random, num_sentences: int, words=12) -> str:
+    """Make text of random sentences, with a paragraph break now and then."""
+    sentences = []
+    for i in range(num_sentences):
+        sentence = " ".join(rng.choice(WORDS) for _ in range(words))
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        if rng.random() < 0.1:
+            sentences.append("\n\n")
+    return " ".join(sentences)
+
+
+def make_comment(rng: random.Random, depth: int, replies: int) -> Dict:
+    """Make a comment snapshot with a tree of replies below it."""
+    comment = {
+        "id": "c%d" % rng.getrandbits(32),
+        "author": "user%d" % rng.randint(0, 10000),
+        "body": make_text(rng, rng.randint(1, 4)),
+        "score": rng.randint(-10, 5000),
+        "replies": []
+    }
+    if depth > 1:
+        comment["replies"] = [
+            make_comment(rng, depth - 1, replies)
+            for _ in range(rng.randint(0, replies))
+        ]
+    return comment
+
+
+def make_submission(name: str, num_sentences: int, num_comments=0,
+                    depth=6, replies=3, seed=0) -> StoredSubmission:
+    """Make a synthetic submission, shaped like a stored one.
+
+    Args:
+        name: Name of the scenario, used as the id of the submission.
+        num_sentences: Number of sentences in the selftext.
+        num_comments: Number of top level comments.
+        depth: Depth of the reply tree below every top level comment.
+        replies: Most direct replies of a comment.
+        seed: Seed of the generated text.
+    Returns:
+        Submission that can be rendered like a praw one.
+    """
+    rng = random.Random(seed)
+    return StoredSubmission({
+        "id": name,
+        "url": "https://old.reddit.com/r/AmItheAsshole/comments/%s/" % name,
+        "title": "AITA for benchmarking the %s scenario of my pipeline "
+                 "instead of deploying it" % name,
+        "selftext": make_text(rng, num_sentences),
+        "score": rng.randint(0, 100000),
+        "author": "throwaway",
+        "subreddit": "AmItheAsshole",
+        "comments": [
+            make_comment(rng, depth, replies) for _ in range(num_comments)
+        ]
+    })
+
+
+def make_scenario(name: str, args) -> StoredSubmission:
+    """Make the submission of a scenario, sized by the command line."""
+    if name == "short":
+        return make_submission(name, args.short_sentences, seed=args.seed)
+    if name == "aita":
+        return make_submission(name, args.aita_sentences, seed=args.seed)
+    return make_submission(
+        name, args.short_sentences, num_comments=args.thread_comments,
+        seed=args.seed
+    )
+
+
+def curate(submission: StoredSubmission, args) -> List:
+    """Curate the comment chains of a submission."""
+    # Passing a reddit instance keeps the generator from creating one, the
+    # submission is already there.
+    return r.ContentGenerator(
+        url=submission.url, reddit=object(), submission=submission
+    ).get_curated_comment_chains(
+        num_chains=args.chains, min_chain_length=3, max_chain_length=6
+    )
+
+
+def check_curation(submission: StoredSubmission, comment_chains: List,
+                   args):
+    """Check a submission gets the same chains and build key every time.
+
+    Otherwise its segment would be rendered again on every run, and the
+    chains in the video would change between reruns.
+    Raises:
+        RuntimeError: If curating again gives different chains or key.
+    """
+    segment = {
+        "url": submission.url, "text_font": args.text_font,
+        "title_font": args.title_font
+    }
+    options = {
+        "backend": args.backend, "still_frames": args.still_frames,
+        "tts_backend": "espeak-ng"
+    }
+    again = curate(submission, args)
+    if ([[comment.id for comment in chain] for chain in again] !=
+            [[comment.id for comment in chain] for chain in comment_chains]):
+        raise RuntimeError("Curating %s again gave different chains."
+                           % submission.id)
+    if (run_reddit_man.get_build_key(segment, submission, again, options) !=
+            run_reddit_man.get_build_key(
+                segment, submission, comment_chains, options)):
+        raise RuntimeError("Curating %s again gave a different build key."
+                           % submission.id)
+
+
+def run_scenario(name: str, args):
+    """Run a scenario through every stage, recording a span for each."""
+    filepath = os.path.join(args.output, name)
+    submission = make_scenario(name, args)
+
+    with instrument.span("tokenize", name) as record:
+        record.items = len(list(utils.iter_sentences(submission.selftext)))
+
+    comment_chains = []
+    if name == "thread":
+        # Count the comments up front, flattening the forest is not part of
+        # curating.
+        num_comments = len(submission.comments.list())
+        with instrument.span("curate", name) as record:
+            comment_chains = curate(submission, args)
+            record.items = num_comments
+        check_curation(submission, comment_chains, args)
+
+    # Render the way run_reddit_man does, to disk or streamed in memory.
+    segment = {"text_font": args.text_font, "title_font": args.title_font}
+    options = {
+        "pipeline": args.pipeline, "save_images": False, "frame_cache": ""
+    }
+    sentences = instrument.timed_iter(
+        run_reddit_man.render_frames(
+            segment, submission, comment_chains, filepath + "/images",
+            options
+        ),
+        "render", name
+    )
+    vb = StubVoiceBot(
+        seconds_per_character=args.seconds_per_character, tone=args.tone
+    )
+    stitcher = stitch.Stitcher(
+        filepath=filepath + "/video", fps=FPS, width=WIDTH, height=HEIGHT,
+        backend=args.backend, still_frames=args.still_frames
+    )
+    if args.pipeline:
+        with instrument.span(
+                "stitch", name, output=filepath + "/video/video_0") as record:
+            stitcher.stitch(instrument.timed_iter(
+                vb.iter_speech_files(
+                    pipeline.iter_in_thread(sentences), filepath + "/audio",
+                    submission
+                ),
+                "speech", name
+            ))
+            record.items = len(stitcher.speech_spans[0])
+    else:
+        sentences = list(sentences)
+        with instrument.span(
+                "speech", name, output=filepath + "/audio") as record:
+            vb.generate_speech_files(
+                sentences, filepath + "/audio", submission
+            )
+            record.items = len(sentences)
+        with instrument.span(
+                "stitch", name, output=filepath + "/video/video_0") as record:
+            stitcher.stitch(sentences)
+            record.items = len(sentences)
+        del sentences
+
+    with instrument.span(
+            "compile", name,
+            output=stitcher.filepath + "/composite_video.mp4") as record:
+        stitcher.compile_all_videos(include_outro=True, voice_bot=vb)
+        record.items = len(stitcher.videos)
+    with instrument.span(
+            "music", name,
+            output=stitcher.filepath + "/composite_video_bg.mp4") as record:
+        stitcher.add_background_music(volume_delta=-30, duck=args.duck_music)
+        record.items = 1
+    return sum(stitcher.durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline.')
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS),
+                        help='Comma separated scenarios to run, of %s.'
+                             % ", ".join(SCENARIOS))
+    parser.add_argument('--short_sentences', default=5, type=int,
+                        help='Sentences in the short post.')
+    parser.add_argument('--aita_sentences', default=300, type=int,
+                        help='Sentences in the AITA post.')
+    parser.add_argument('--thread_comments', default=2000, type=int,
+                        help='Top level comments of the thread, each with a '
+                             'tree of replies.')
+    parser.add_argument('--chains', default=20, type=int,
+                        help='Comment chains curated from the thread.')
+    parser.add_argument('--seconds_per_character', default=0.06,
+                        type=float,
+                        help='Length of stub speech per character of text.')
+    parser.add_argument('--tone', action='store_true',
+                        help='Write a tone as stub speech instead of '
+                             'silence.')
+    parser.add_argument('--backend', default='moviepy',
+                        choices=stitch.BACKENDS,
+                        help='Video muxing backend.')
+    parser.add_argument('--still_frames', action='store_true',
+                        help='Encode each image once with its duration.')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Stream sentences through rendering, speech '
+                             'and encoding, like run_reddit_man.py '
+                             '--pipeline.')
+    parser.add_argument('--duck_music', action='store_true',
+                        help='Lower the background music under speech.')
+    parser.add_argument('--text_font', default='DejaVuSans.ttf',
+                        help='Font of the text.')
+    parser.add_argument('--title_font', default='DejaVuSans-Bold.ttf',
+                        help='Font of the title.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the synthetic submissions.')
+    parser.add_argument('--output', default='_tmp/bench',
+                        help='Directory to work in, emptied first.')
+    parser.add_argument('--report', default='',
+                        help='Write a JSON report of every stage to this '
+                             'file.')
+    args = parser.parse_args()
+    if shutil.which("ffmpeg") is None:
+        parser.error("ffmpeg is required, install it and put it on PATH.")
+
+    scenarios = args.scenarios.split(",")
+    for name in scenarios:
+        assert name in SCENARIOS, "Unknown scenario %s." % name
+    if os.path.exists(args.output):
+        shutil.rmtree(args.output)
+    instrument.enable(args.output + "/instrument")
+
+    durations = {}
+    for name in scenarios:
+        durations[name] = run_scenario(name, args)
+
+    print("%-8s %-9s %7s %9s %10s %9s %9s %9s" % (
+        "scenario", "stage", "items", "wall s", "items/s", "cpu s",
+        "rss MB", "out MB"
+    ))
+    for record in instrument.load_spans(args.output + "/instrument"):
+        items = record["items"] or 0
+        print("%-8s %-9s %7d %9.3f %10.1f %9.3f %9.1f %9.2f" % (
+            record["segment"], record["name"], items, record["wall"],
+            items / max(record["wall"], 1e-9),
+            record["cpu"] + record["child_cpu"],
+            record["peak_rss"] / 1024.0 ** 2,
+            record["bytes_written"] / 1024.0 ** 2
+        ))
+    for name in scenarios:
+        print("%s: %.1f seconds of video" % (name, durations[name]))
+    if args.report:
+        instrument.write_report(args.output + "/instrument", args.report)
+
+
+if __name__ == "__main__":
+    main()
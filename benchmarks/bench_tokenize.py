@@ -0,0 +1,91 @@
+"""Benchmark the sentence tokenizer on large selftexts.
+
+Compares redtts.utils.tokenize against the four pass re.split tokenizer it
+replaced, checking both produce the same sentences. tokenize caches its
+results, so the iter_sentences line is the cost of tokenizing new text and
+the cache hit line only measures looking text up again.
+
+python benchmarks/bench_tokenize.py --words 200000
+"""
+from typing import List
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import redtts.utils as utils  # noqa: E402
+
+
+WORDS = [
+    "the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "I",
+    "my", "landlord", "never", "fixed", "it", "Mr.", "Smith", "e.g.",
+    "U.S.", "honestly", "revenge"
+]
+PUNCTUATION = [".", "?", ",", ";", ".\"", "?\"", "", "", "", "", "", ""]
+
+
+def legacy_tokenize(text: str) -> List[str]:
+    """The four pass tokenizer, kept as the reference output."""
+    no_url_text = re.sub(r'^https?:\/\/.*[\r\n]*', '',
+                         text, flags=re.MULTILINE)
+    parse_1 = re.split(
+        r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s", no_url_text
+    )
+    parse_2 = []
+    for phrase in parse_1:
+        parse_2.extend(
+            re.split(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\,|\;)\s", phrase)
+        )
+    parse_3 = []
+    for phrase in parse_2:
+        parse_3.extend(
+            re.split(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\,|\;)\s", phrase)
+        )
+    parse_4 = []
+    for phrase in parse_3:
+        parse_4.extend(
+            re.split(r"(?<=\.\"|\?\")\s", phrase)
+        )
+    return parse_4
+
+
+def make_selftext(num_words: int, seed=0) -> str:
+    """Make a selftext of random words, punctuation, paragraphs and links."""
+    rng = random.Random(seed)
+    words = []
+    for i in range(num_words):
+        words.append(rng.choice(WORDS) + rng.choice(PUNCTUATION))
+        if rng.random() < 0.01:
+            words.append("\n\n")
+        if rng.random() < 0.001:
+            words.append("\nhttps://example.com/%d\n" % i)
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tokenize.')
+    parser.add_argument('--words', default=200000, type=int,
+                        help='Number of words in the selftext.')
+    parser.add_argument('--repeat', default=5, type=int,
+                        help='Number of timed runs, the best is reported.')
+    args = parser.parse_args()
+
+    text = make_selftext(args.words)
+    assert legacy_tokenize(text) == utils.tokenize(text)
+
+    timings = [
+        ("legacy re.split x4", lambda: legacy_tokenize(text)),
+        ("iter_sentences", lambda: list(utils.iter_sentences(text))),
+        ("tokenize, cache hit", lambda: utils.tokenize(text)),
+    ]
+    print("%d words, %d sentences" % (args.words, len(utils.tokenize(text))))
+    for name, function in timings:
+        best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        print("%-20s %8.2f ms" % (name, best * 1000))
+
+
+if __name__ == "__main__":
+    main()
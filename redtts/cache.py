@@ -0,0 +1,92 @@
+from typing import Optional
+import os
+import shutil
+
+
+class FileCache(object):
+    """Content addressed on disk cache of files."""
+
+    def __init__(self, filepath: str, max_bytes=2 * 1024 ** 3):
+        """ Initialize file cache.
+
+        Files are keyed by a hash of the inputs that produced them, the least
+        recently used files are evicted once the cache grows past max_bytes.
+        Args:
+            filepath: Directory to store cached files.
+            max_bytes: Maximum total size of the cached files.
+        """
+        super(FileCache, self).__init__()
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        if not os.path.exists(filepath):
+            os.makedirs(filepath)
+
+        # Size of the cache is counted on first insert.
+        self.total_bytes = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.filepath, key[:2], key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a file, marking it as recently used.
+
+        Args:
+            key: Cache key of the file.
+        Returns:
+            Filename of the cached file, None if not cached.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key: str, filename: str) -> str:
+        """Store a copy of a file in the cache.
+
+        Args:
+            key: Cache key of the file.
+            filename: File to store.
+        Returns:
+            Filename of the cached file.
+        """
+        path = self._path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        # Copy then rename so concurrent readers never see a partial file.
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        shutil.copyfile(filename, tmp_path)
+        os.replace(tmp_path, path)
+
+        if self.total_bytes is None:
+            self.total_bytes = sum(
+                os.path.getsize(entry) for entry, _ in self._entries()
+            )
+        else:
+            self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        return path
+
+    def _entries(self):
+        """Yield filename and stat result of every cached file."""
+        for directory in os.scandir(self.filepath):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if not entry.name.endswith(".tmp"):
+                    yield entry.path, entry.stat()
+
+    def _evict(self):
+        """Remove least recently used files until under max_bytes."""
+        entries = sorted(self._entries(), key=lambda x: x[1].st_mtime)
+        self.total_bytes = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= stat.st_size
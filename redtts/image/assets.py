@@ -0,0 +1,53 @@
+from PIL import ImageFont, Image
+from typing import Tuple
+from .. import utils
+import functools
+
+
+# Color of the frame background.
+BACKGROUND_COLOR = (20, 20, 20)
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    """Load a font, each font and size is only loaded once per process.
+
+    Args:
+        font: Font file or name of a system font.
+        size: Font size.
+    Returns:
+        The loaded font.
+    """
+    return ImageFont.truetype(font, size)
+
+
+@functools.lru_cache(maxsize=None)
+def get_asset(name: str, size: Tuple[int, int] = None) -> Image.Image:
+    """Load an image asset, each asset and size is only loaded once.
+
+    Args:
+        name: Name of the png in the asset directory, without extension.
+        size: Width and height to resize the asset to, None keeps the size.
+    Returns:
+        The decoded asset, callers must not draw on it.
+    """
+    asset = Image.open(utils.get_asset_filepath() + "/%s.png" % name)
+    if size is not None:
+        asset = asset.resize(size)
+    asset.load()
+    return asset
+
+
+@functools.lru_cache(maxsize=4)
+def get_template(size: Tuple[int, int]) -> Image.Image:
+    """Get a blank frame of a size.
+
+    Frames start as a copy of a template instead of being created from
+    scratch. Assets such as the score arrows move with the score, so they are
+    pasted onto every frame rather than kept in the template.
+    Args:
+        size: Width and height of the frame.
+    Returns:
+        The template, callers must copy it before drawing on it.
+    """
+    return Image.new(mode="RGB", size=size, color=BACKGROUND_COLOR)
@@ -1,14 +1,29 @@
 from PIL import ImageFont, Image, ImageDraw
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Union
 from .. import utils
+from ..cache import FileCache
+from ..sentence import Sentence
+from . import assets
+from . import layout
+import hashlib
 import os
 import praw
+import shutil
+
+
+# A frame is either the filename of a PNG or an in memory image.
+FrameType = Union[str, Image.Image]
+
+# Size the header assets are drawn at.
+ASSET_SIZE = (190, 190)
 
 
 def render_submission(submission: praw.models.Submission, text_font_size: int,
                       text_font: str, image_max_length: int,
                       image_max_height: int, filepath: str, title_font: str,
-                      title_size: int) -> Dict[str, str]:
+                      title_size: int, in_memory: bool = False,
+                      save_images: bool = True, cache: FileCache = None,
+                      lazy: bool = False) -> Iterable[Sentence]:
     """Render a reddit submission into a sequence of images.
 
     Submission, each image should contain consecutive sentences overlayed on
@@ -21,184 +36,333 @@ def render_submission(submission: praw.models.Submission, text_font_size: int,
         image_max_length: Length of the image frame.
         image_max_height: Height of the image frame.
         filepath: String representing path of image.
+        title_font: Font style of the title.
+        title_size: Font size of the title.
+        in_memory: Whether to map sentences to in memory frames instead of
+            filenames, so the stitcher does not have to decode PNGs.
+        save_images: Whether to write the frames to disk as PNGs. Always
+            true when not rendering in memory.
+        cache: Cache of previously saved frames, frames whose layout did not
+            change are copied from it instead of drawn and encoded.
+        lazy: Whether to return a generator that draws each frame as it is
+            consumed, so frames can be streamed instead of all held at once.
     Return:
-        Dictionary mapping sentence string to filename.
+        Sentences of the submission, the title first, with their image set
+        to a filename, or to a PIL image when rendering in memory. A list
+        unless lazy.
     """
-    # Tokenizes paragraph by sentence.
-    text = submission.selftext
-    text_list = utils.tokenize(text)
-
-    # Open up/down arrow images.
-    up_arrow = Image.open(utils.get_asset_filepath()+"/up_arrow.png")
-    down_arrow = Image.open(utils.get_asset_filepath()+"/down_arrow.png")
-    up_arrow = up_arrow.resize((190, 190))
-    down_arrow = down_arrow.resize((190, 190))
-
-    # Declare the image object with the specified dimensions provided
-    # to the function. Declare the font with the specified font.
-    # Declare the draw object to be used to write text to the image object
-    image = Image.new(mode="RGBA", size=(image_max_length, image_max_height),
-                      color=(20, 20, 20))
-    fnt = ImageFont.truetype(text_font, text_font_size)
-    title_fnt = ImageFont.truetype(title_font, title_size)
-    score_fnt = ImageFont.truetype(title_font, text_font_size)
-    author_fnt = ImageFont.truetype(text_font, text_font_size - 12)
-    draw = ImageDraw.Draw(image)
-
-    # Map to store text keyed to filenames of images.
-    image_map = {}
-
-    # Declare top margin
-    top_margin = title_size*2 + 30
-
-    # Draw score and declare left_margin
-    if int(submission.score) > 999:
-        score = str(round(int(submission.score)/1000, 2)) + "K"
-        draw.text((10, int(top_margin*.55)), score,
-                  font=score_fnt, fill=(225, 225, 225), align="left")
-        left_margin = fnt.getsize(score + "   ")[0]
-    else:
-        score = str(submission.score)
-        draw.text((10, int(top_margin*.55)), score,
-                  font=score_fnt, fill=(225, 225, 225), align="left")
-        left_margin = fnt.getsize(score + "   ")[0]
-
-    # Draw the Arrows
-    image.paste(
-        up_arrow, (int(left_margin/2) - 15, int(top_margin*.2)), mask=up_arrow
+    save_images = save_images or not in_memory
+
+    # Every frame is keyed on its dimensions and the files that go into it,
+    # along with what is drawn on it.
+    frame_size = (image_max_length, image_max_height)
+    frame_key = utils.hash_inputs(
+        frame_size, utils.file_fingerprint(text_font),
+        utils.file_fingerprint(title_font),
+        utils.file_fingerprint(utils.get_asset_filepath()+"/up_arrow.png"),
+        utils.file_fingerprint(utils.get_asset_filepath()+"/down_arrow.png")
     )
-    image.paste(
-        down_arrow, (int(left_margin/2) - 15, int(top_margin)+5),
-        mask=down_arrow
+
+    # Lay out every frame before drawing any of them.
+    model = paginate_submission(
+        submission=submission, text_font_size=text_font_size,
+        text_font=text_font, image_max_length=image_max_length,
+        image_max_height=image_max_height, title_font=title_font,
+        title_size=title_size
     )
 
-    # Draw author.
-    draw.text(
-        (left_margin, int(text_font_size * .2)),
-        "Posted by u/"+str(submission.author),
-        font=author_fnt, fill=(180, 180, 180),
-        align="left"
+    sentences = _iter_frames(
+        model, frame_size, frame_key, filepath, in_memory, save_images, cache
     )
-    # Draw title.
-    title_x_position = left_margin
-    title_y_position = 5 + text_font_size + int(text_font_size / 2)
-    title_words = str(submission.title).split(" ")
-    for word in title_words:
-        if title_x_position + title_fnt.getsize(word + " ")[0] > image_max_length:
-            title_y_position = title_y_position + 15 + title_size
-            title_x_position = left_margin
-            draw.text(
-                (title_x_position, title_y_position), word,
-                font=title_fnt, fill=(225, 225, 225), align="left"
-            )
-            title_x_position = (
-                    title_x_position + title_fnt.getsize(word + " ")[0]
-            )
-            top_margin = top_margin + 30 + title_size
-        else:
-            draw.text(
-                (title_x_position, title_y_position), word,
-                font=title_fnt, fill=(225, 225, 225), align="left"
-            )
-            title_x_position = (
-                    title_x_position + title_fnt.getsize(word + " ")[0]
-            )
+    return sentences if lazy else list(sentences)
 
-    # Write to files.
-    if not os.path.exists(filepath):
-        os.makedirs(filepath)
-    filename = filepath + "/image_%s.png" % str(0)
-    image_map[str(submission.title)+str(0)] = filename
-    image.save(filename)
 
-    x = left_margin
-    y = top_margin
+def paginate_submission(submission: praw.models.Submission,
+                        text_font_size: int, text_font: str,
+                        image_max_length: int, image_max_height: int,
+                        title_font: str,
+                        title_size: int) -> layout.PageModel:
+    """Lay out a reddit submission into pages without rendering it.
+
+    Use to preview how a submission is split into frames and pages, takes
+    the same arguments as render_submission.
+    Args:
+        submission: Reddit submission to be laid out.
+        text_font_size: Font size of the submission renderer.
+        text_font: Font style.
+        image_max_length: Length of the image frame.
+        image_max_height: Height of the image frame.
+        title_font: Font style of the title.
+        title_size: Font size of the title.
+    Return:
+        Page model with the drawing operations of every page, and the
+        sentence and page of every frame.
+    """
+    # Tokenizes paragraph by sentence.
+    text_list = utils.tokenize(submission.selftext)
+
+    # Declare the fonts with the specified font styles.
+    fonts = layout.SubmissionFonts(
+        text=assets.get_font(text_font, text_font_size),
+        title=assets.get_font(title_font, title_size),
+        score=assets.get_font(title_font, text_font_size),
+        author=assets.get_font(text_font, text_font_size - 12)
+    )
+    return layout.layout_submission(
+        submission=submission, text_list=text_list, fonts=fonts,
+        text_font_size=text_font_size, title_size=title_size,
+        image_max_length=image_max_length, image_max_height=image_max_height,
+        measurer=_MEASURER
+    )
+
 
-    # Count is for the number related to the png files double_new_line variable
-    # is used to handle newline characters in strings sentence_too_long is the
-    # variable to account for setences that would not fit on same image.
-    count = 1
-    sentence_too_long = 0
+def _iter_frames(model: layout.PageModel, frame_size, frame_key: str,
+                 filepath: str, in_memory: bool, save_images: bool,
+                 cache: FileCache = None,
+                 first_index: int = 0) -> Iterator[Sentence]:
+    """Draw every frame of a page model, one frame at a time.
 
-    # Create directory.
-    if not os.path.exists(filepath):
+    Args:
+        model: Page model to draw.
+        frame_size: Width and height of the frames.
+        frame_key: Hash of the inputs every frame depends on.
+        filepath: Where to store the frames if saving images.
+        in_memory: Whether to map sentences to in memory frames.
+        save_images: Whether to write the frames to disk as PNGs.
+        cache: Cache of previously saved frames, only used if saving
+            images.
+        first_index: Index in the video of the sentence of the first frame.
+    Yields:
+        Sentence of every frame, with its image set.
+    """
+    if save_images and not os.path.exists(filepath):
         os.makedirs(filepath)
 
-    for i in range(0, len(text_list)):
-        # Splits splits sentence by the lines exposing newlines as '' in the
-        # split_on_newline list
-        split_on_newline = text_list[i].splitlines()
-        if '' in split_on_newline:
-            while '' in split_on_newline:
-                split_on_newline.remove('')
-            x = left_margin
-            y = y + 15 + text_font_size * 2
-
-        for splits in split_on_newline:
-            words = splits.split(" ")
-            while '' in words:
-                words.remove('')
-            for word in words:
-                # If the added word exceeds the dimensions of the image
-                if ((x + fnt.getsize(word + " ")[0]) > image_max_length
-                        or (image_max_height - (y+15)) < text_font_size):
-                    # check if it exceeded the y dimension first
-                    if ((image_max_height - y) < text_font_size or
-                            abs((y + 15 + text_font_size) - image_max_height)
-                            < text_font_size):
-                        sentence_too_long = 1
-                        break
-                    # handles exceeding x dimensions
-                    else:
-                        x = left_margin
-                        y = y + 15 + text_font_size
-                        draw.text((x, y), word, font=fnt, fill=(225, 225, 225),
-                                  align="left")
-                        x = x + fnt.getsize(word + " ")[0]
-                else:
-                    # If adding new word doesnt exceed size of image draw it,
-                    # then increment x the length of the word.
-                    draw.text((x, y), word, font=fnt, fill=(225, 225, 225),
-                              align="left")
-                    x = x + fnt.getsize(word + " ")[0]
-
-            # If the sentence was too long come back to beginning of outer for-
-            # loop(word loop) and put the sentence on a new image only equal to
-            # 1 if the entire sentence does not fit on image
-            if sentence_too_long == 1:
-                sentence_too_long = 0
-                image = Image.new(
-                    mode="RGBA", size=(image_max_length, image_max_height),
-                    color=(20, 20, 20)
+    # Draw each page up to where each frame snapshots it, starting from a
+    # blank template.
+    canvas, page, drawn = None, None, 0
+    for count, frame in enumerate(model.frames, first_index):
+        if frame.page != page:
+            page, drawn = frame.page, 0
+            canvas = _FrameCanvas(frame_size, frame_key)
+        for operation in model.pages[page][drawn:frame.num_operations]:
+            if isinstance(operation, layout.PasteOperation):
+                canvas.paste(operation.name, ASSET_SIZE, operation.xy)
+            else:
+                canvas.text(
+                    operation.xy, operation.text, font=operation.font,
+                    fill=operation.fill
                 )
-                draw = ImageDraw.Draw(image)
-                x = left_margin
-                y = 5
-                words = splits.split(" ")
-                while '' in words:
-                    words.remove('')
-                for word in words:
-                    if (x + fnt.getsize(word + " ")[0]) > image_max_length:
-                        x = left_margin
-                        y = y + 15 + text_font_size
-                        draw.text((x, y), word, font=fnt, fill=(225, 225, 225),
-                                  align="left")
-                        x = x + fnt.getsize(word + " ")[0]
-                    else:
-                        draw.text((x, y), word, font=fnt, fill=(225, 225, 225),
-                                  align="left")
-                        x = x + fnt.getsize(word + " ")[0]
+        drawn = frame.num_operations
         filename = filepath + "/image_%s.png" % str(count)
-        image_map[text_list[i] + str(count)] = filename
+        yield Sentence(count, frame.text, image=_emit_frame(
+            canvas, filename, in_memory, save_images, cache
+        ))
+
+
+class _WordSprites(object):
+    """Glyph masks of words, each word is rasterized once per font."""
+
+    def __init__(self, max_sprites=100000):
+        """ Initialize word sprites.
+
+        Args:
+            max_sprites: Number of sprites to keep before starting over.
+        """
+        super(_WordSprites, self).__init__()
+        self.sprites = {}
+        self.max_sprites = max_sprites
+
+    def get(self, font: ImageFont.FreeTypeFont, text: str):
+        """Get the mask of text and where it sits relative to the origin.
+
+        Args:
+            font: Font the text is drawn with.
+            text: Text to rasterize.
+        Returns:
+            Mask of the text and its left and top offset.
+        """
+        sprite = self.sprites.get((font, text))
+        if sprite is None:
+            if len(self.sprites) >= self.max_sprites:
+                self.sprites.clear()
+            left, top, right, bottom = font.getbbox(text)
+            mask = Image.new(
+                "L", (max(right - left, 1), max(bottom - top, 1))
+            )
+            ImageDraw.Draw(mask).text(
+                (-left, -top), text, font=font, fill=255
+            )
+            sprite = self.sprites[(font, text)] = (mask, (left, top))
+        return sprite
+
+
+class _FrameCanvas(object):
+    """Frame being drawn on, drawing is deferred until the frame is needed.
+
+    Every drawing operation is folded into a hash identifying the frame, so
+    frames rendered by a previous run can be taken from the cache without
+    drawing them.
+    """
+
+    def __init__(self, size, key: str):
+        """ Initialize frame canvas.
+
+        Args:
+            size: Width and height of the frame.
+            key: Hash of the inputs every frame depends on.
+        """
+        super(_FrameCanvas, self).__init__()
+        self.size = size
+        self.image = None
+        self.operations = []
+        self.hasher = hashlib.sha256(key.encode("utf-8"))
+
+    def text(self, xy, text, font, fill, align="left"):
+        """Queue drawing text, takes the same arguments as ImageDraw.text."""
+        self.operations.append(("text", xy, text, font, fill, align))
+        self.hasher.update(repr(
+            ("text", xy, text, font.path, font.size, fill, align)
+        ).encode("utf-8"))
+
+    def paste(self, name, size, xy):
+        """Queue pasting an asset with its alpha channel as mask.
+
+        Args:
+            name: Name of the asset.
+            size: Width and height of the asset.
+            xy: Position of the top left corner.
+        """
+        self.operations.append(("paste", xy, assets.get_asset(name, size)))
+        self.hasher.update(repr(("paste", xy, name)).encode("utf-8"))
+
+    def key(self) -> str:
+        """Hash identifying the frame as drawn so far."""
+        return self.hasher.hexdigest()
+
+    def render(self) -> Image.Image:
+        """Draw the queued operations and get the frame.
+
+        Text is composited from word sprites, which gives the same pixels as
+        drawing it while only rasterizing every unique word once. Frames are
+        opaque so they are drawn in RGB, ready for the video encoder.
+        """
+        if self.image is None:
+            self.image = assets.get_template(self.size).copy()
+        for operation in self.operations:
+            if operation[0] == "text":
+                _, (x, y), text, font, fill, _ = operation
+                mask, (left, top) = _SPRITES.get(font, text)
+                self.image.paste(fill, (x + left, y + top), mask)
+            else:
+                _, xy, image = operation
+                self.image.paste(image, xy, mask=image)
+        self.operations = []
+        return self.image
+
+
+# Measurements and sprites are shared by every render in the process, fonts
+# come from the asset registry so they stay valid across renders.
+_MEASURER = layout.TextMeasurer()
+_SPRITES = _WordSprites()
+
+
+def _emit_frame(canvas: _FrameCanvas, filename: str, in_memory: bool,
+                save_images: bool, cache: FileCache = None) -> FrameType:
+    """Snapshot the frame currently being drawn.
+
+    Args:
+        canvas: Canvas being drawn on.
+        filename: Where to store the frame if saving images.
+        in_memory: Whether to return a copy of the frame instead of filename.
+        save_images: Whether to write the frame to disk.
+        cache: Cache of previously saved frames, only used if saving
+            images.
+    Returns:
+        Filename of the frame, or an RGB copy of the frame if in memory.
+    """
+    # Frames are cached as PNGs, only worth it when they are saved anyway.
+    # Decoding a cached PNG takes longer than drawing the frame again, so
+    # frames that are only kept in memory skip the cache.
+    if cache is not None and save_images:
+        cached_filename = cache.get(canvas.key())
+        if cached_filename is not None:
+            try:
+                shutil.copyfile(cached_filename, filename)
+            except FileNotFoundError:
+                # Evicted since it was looked up, render it instead.
+                cached_filename = None
+        if cached_filename is not None:
+            if in_memory:
+                return Image.open(filename).convert("RGB")
+            return filename
+
+    image = canvas.render()
+    if save_images:
         image.save(filename)
-        count += 1
+        if cache is not None:
+            cache.put(canvas.key(), filename)
+    if in_memory:
+        # Copy the pixels, later draws must not leak into the frame.
+        return image.copy()
+    return filename
 
-    return image_map
+
+def comment_chain_sentences(comment_chains: List[List[praw.models.Comment]]
+                            ) -> List[List[List[str]]]:
+    """Tokenize every comment of comment chains into sentences.
+
+    Args:
+        comment_chains: Chains of comments, each chain in reply order.
+    Return:
+        Sentences of every comment in every chain, blank sentences are left
+        out since there is nothing to speak.
+    """
+    return [
+        [
+            [sentence for sentence in utils.tokenize(comment.body)
+             if sentence.strip()]
+            for comment in chain
+        ]
+        for chain in comment_chains
+    ]
+
+
+def paginate_comment_chains(comment_chains: List[List[praw.models.Comment]],
+                            font_size: int, font: str, image_max_length: int,
+                            image_max_height: int) -> layout.PageModel:
+    """Lay out reddit comment chains into pages without rendering them.
+
+    Use to preview how comment chains are split into frames and pages,
+    takes the same arguments as render_comment_chains.
+    Args:
+        comment_chains: Chains of comments, each chain in reply order.
+        font_size: Font size of the comment text.
+        font: Font style.
+        image_max_length: Length of the image frame.
+        image_max_height: Height of the image frame.
+    Return:
+        Page model with the drawing operations of every page, and the
+        sentence and page of every frame.
+    """
+    fonts = layout.CommentFonts(
+        text=assets.get_font(font, font_size),
+        author=assets.get_font(font, font_size - 12)
+    )
+    return layout.layout_comment_chains(
+        comment_chains=comment_chains,
+        text_lists=comment_chain_sentences(comment_chains), fonts=fonts,
+        text_font_size=font_size, image_max_length=image_max_length,
+        image_max_height=image_max_height, measurer=_MEASURER
+    )
 
 
 def render_comment_chains(comment_chains: List[List[praw.models.Comment]],
-                          filename: str, font_size: int, font: str,
-                          image_max_length: int, image_max_height: int):
+                          filepath: str, font_size: int, font: str,
+                          image_max_length: int, image_max_height: int,
+                          in_memory: bool = False, save_images: bool = True,
+                          cache: FileCache = None, first_index: int = 0,
+                          lazy: bool = False) -> Iterable[Sentence]:
     """Render a reddit comment chains into a sequence of images.
 
     Each image should contain consecutive sentences overlayed on
@@ -208,13 +372,37 @@ def render_comment_chains(comment_chains: List[List[praw.models.Comment]],
     comments in a chain indented. The first comment of every chain starts
     fresh without indentations.
     Args:
-        submission: Reddit submission to be rendered.
-        filename: Filename to store the images.
-        font_size: Font size of the submission renderer.
+        comment_chains: Chains of comments, each chain in reply order.
+        filepath: String representing path of image.
+        font_size: Font size of the comment text.
         font: Font style.
         image_max_length: Length of the image frame.
         image_max_height: Height of the image frame.
+        in_memory: Whether to map sentences to in memory frames instead of
+            filenames, so the stitcher does not have to decode PNGs.
+        save_images: Whether to write the frames to disk as PNGs. Always
+            true when not rendering in memory.
+        cache: Cache of previously saved frames, only used if saving
+            images.
+        first_index: Index in the video of the first sentence, for comment
+            chains that follow other content such as their submission.
+        lazy: Whether to return a generator that draws each frame as it is
+            consumed.
     Return:
-        Dictionary mapping sentence string to filename.
+        Sentences of the comment chains, with their image set to a filename,
+        or to a PIL image when rendering in memory. A list unless lazy.
     """
-    return
+    save_images = save_images or not in_memory
+    frame_size = (image_max_length, image_max_height)
+    frame_key = utils.hash_inputs(
+        "comments", frame_size, utils.file_fingerprint(font)
+    )
+    model = paginate_comment_chains(
+        comment_chains=comment_chains, font_size=font_size, font=font,
+        image_max_length=image_max_length, image_max_height=image_max_height
+    )
+    sentences = _iter_frames(
+        model, frame_size, frame_key, filepath, in_memory, save_images, cache,
+        first_index=first_index
+    )
+    return sentences if lazy else list(sentences)
@@ -0,0 +1,371 @@
+from collections import namedtuple
+from PIL import ImageFont
+from typing import List, Tuple
+
+
+# Colors of the text drawn on frames.
+TEXT_FILL = (225, 225, 225)
+AUTHOR_FILL = (180, 180, 180)
+
+# Drawing operations, text is drawn with a font and pastes refer to an asset
+# by name so the page model stays pure data.
+TextOperation = namedtuple("TextOperation", ["xy", "text", "font", "fill"])
+PasteOperation = namedtuple("PasteOperation", ["xy", "name"])
+
+# A frame is a snapshot of a page after its first num_operations operations,
+# text is the sentence the frame is shown for.
+Frame = namedtuple("Frame", ["text", "page", "num_operations"])
+
+# Fonts used to lay out a submission.
+SubmissionFonts = namedtuple(
+    "SubmissionFonts", ["text", "title", "score", "author"]
+)
+
+# Fonts used to lay out comment chains.
+CommentFonts = namedtuple("CommentFonts", ["text", "author"])
+
+# Distance of comments from the edges of the frame, and the indentation of
+# each level of replies. Replies deeper than MAX_COMMENT_DEPTH line up with
+# it, and no comment is indented so far its lines get narrower than
+# MIN_COMMENT_WIDTH.
+COMMENT_MARGIN = 20
+COMMENT_INDENT = 60
+MAX_COMMENT_DEPTH = 8
+MIN_COMMENT_WIDTH = 480
+
+
+class PageModel(object):
+    """Layout of a sequence of frames, computed without drawing anything."""
+
+    def __init__(self):
+        """ Initialize page model.
+
+        Pages hold the drawing operations of each image frame in order,
+        frames snapshot a prefix of a page.
+        """
+        super(PageModel, self).__init__()
+        self.pages = []
+        self.frames = []
+
+    def new_page(self) -> List:
+        """Start a new page and get its list of operations."""
+        self.pages.append([])
+        return self.pages[-1]
+
+    def add_frame(self, text: str):
+        """Snapshot the current page for the given sentence."""
+        self.frames.append(
+            Frame(text, len(self.pages) - 1, len(self.pages[-1]))
+        )
+
+    def lines(self, page: int) -> List[Tuple[int, str]]:
+        """Get the lines of text on a page.
+
+        Args:
+            page: Index of the page.
+        Returns:
+            List of vertical position and text of every line, in the order
+            they are drawn.
+        """
+        lines = []
+        for operation in self.pages[page]:
+            if not isinstance(operation, TextOperation):
+                continue
+            y = operation.xy[1]
+            if lines and lines[-1][0] == y:
+                lines[-1] = (y, lines[-1][1] + " " + operation.text)
+            else:
+                lines.append((y, operation.text))
+        return lines
+
+
+class TextMeasurer(object):
+    """Measures text, every unique string is measured once per font."""
+
+    def __init__(self, max_widths=100000):
+        """ Initialize text measurer.
+
+        Args:
+            max_widths: Number of widths to keep before starting over.
+        """
+        super(TextMeasurer, self).__init__()
+        self.widths = {}
+        self.max_widths = max_widths
+
+    def width(self, font: ImageFont.FreeTypeFont, text: str) -> int:
+        """Get the width of text rendered with a font.
+
+        Args:
+            font: Font the text is rendered with.
+            text: Text to measure.
+        Returns:
+            Width of the text in pixels.
+        """
+        width = self.widths.get((font, text))
+        if width is None:
+            if len(self.widths) >= self.max_widths:
+                self.widths.clear()
+            width = self.widths[(font, text)] = font.getsize(text)[0]
+        return width
+
+
+def _split_words(text: str) -> List[str]:
+    """Split text on spaces, dropping empty words."""
+    return [word for word in text.split(" ") if word != '']
+
+
+def layout_submission(submission, text_list: List[str],
+                      fonts: SubmissionFonts, text_font_size: int,
+                      title_size: int, image_max_length: int,
+                      image_max_height: int,
+                      measurer: TextMeasurer = None) -> PageModel:
+    """Lay out a reddit submission into pages without drawing it.
+
+    The first frame shows the header (score, arrows, author and title), every
+    following frame adds one sentence. If text overflows from a page,
+    continue on a fresh page.
+    Args:
+        submission: Reddit submission to be laid out.
+        text_list: Sentences of the submission's selftext.
+        fonts: Fonts to lay out the submission with.
+        text_font_size: Font size of the submission text.
+        title_size: Font size of the title.
+        image_max_length: Length of the image frame.
+        image_max_height: Height of the image frame.
+        measurer: Text measurer, shared to reuse measurements across calls.
+    Returns:
+        Page model of the submission.
+    """
+    if measurer is None:
+        measurer = TextMeasurer()
+    model = PageModel()
+    operations = model.new_page()
+
+    # Declare top margin
+    top_margin = title_size*2 + 30
+
+    # Declare left_margin based on the width of the score.
+    if int(submission.score) > 999:
+        score = str(round(int(submission.score)/1000, 2)) + "K"
+    else:
+        score = str(submission.score)
+    left_margin = measurer.width(fonts.text, score + "   ")
+
+    # Draw the Arrows first, so they can come from a shared page template,
+    # then the score.
+    operations.append(PasteOperation(
+        (int(left_margin/2) - 15, int(top_margin*.2)), "up_arrow"
+    ))
+    operations.append(PasteOperation(
+        (int(left_margin/2) - 15, int(top_margin)+5), "down_arrow"
+    ))
+    operations.append(TextOperation(
+        (10, int(top_margin*.55)), score, fonts.score, TEXT_FILL
+    ))
+
+    # Draw author.
+    operations.append(TextOperation(
+        (left_margin, int(text_font_size * .2)),
+        "Posted by u/"+str(submission.author), fonts.author, AUTHOR_FILL
+    ))
+
+    # Draw title, wrapping onto new lines pushes the text down.
+    title_x_position = left_margin
+    title_y_position = 5 + text_font_size + int(text_font_size / 2)
+    for word in str(submission.title).split(" "):
+        word_width = measurer.width(fonts.title, word + " ")
+        if title_x_position + word_width > image_max_length:
+            title_y_position = title_y_position + 15 + title_size
+            title_x_position = left_margin
+            top_margin = top_margin + 30 + title_size
+        operations.append(TextOperation(
+            (title_x_position, title_y_position), word, fonts.title,
+            TEXT_FILL
+        ))
+        title_x_position = title_x_position + word_width
+    model.add_frame(str(submission.title))
+
+    x = left_margin
+    y = top_margin
+    for sentence in text_list:
+        # Splits sentence by the lines, blank lines start a new paragraph.
+        split_on_newline = sentence.splitlines()
+        if '' in split_on_newline:
+            split_on_newline = [line for line in split_on_newline
+                                if line != '']
+            x = left_margin
+            y = y + 15 + text_font_size * 2
+
+        for splits in split_on_newline:
+            sentence_too_long = False
+            for word in _split_words(splits):
+                word_width = measurer.width(fonts.text, word + " ")
+                # If the added word exceeds the dimensions of the image
+                if (x + word_width > image_max_length
+                        or (image_max_height - (y+15)) < text_font_size):
+                    # check if it exceeded the y dimension first
+                    if ((image_max_height - y) < text_font_size or
+                            abs((y + 15 + text_font_size) - image_max_height)
+                            < text_font_size):
+                        sentence_too_long = True
+                        break
+                    # handles exceeding x dimensions
+                    x = left_margin
+                    y = y + 15 + text_font_size
+                operations.append(
+                    TextOperation((x, y), word, fonts.text, TEXT_FILL)
+                )
+                x = x + word_width
+
+            # If the line does not fit on the page, put the whole line on a
+            # new page.
+            if sentence_too_long:
+                operations = model.new_page()
+                x = left_margin
+                y = 5
+                for word in _split_words(splits):
+                    word_width = measurer.width(fonts.text, word + " ")
+                    if x + word_width > image_max_length:
+                        x = left_margin
+                        y = y + 15 + text_font_size
+                    operations.append(
+                        TextOperation((x, y), word, fonts.text, TEXT_FILL)
+                    )
+                    x = x + word_width
+        model.add_frame(sentence)
+
+    return model
+
+
+def _flow_lines(lines: List[str], font: ImageFont.FreeTypeFont, x: int,
+                y: int, left: int, right: int, line_height: int,
+                measurer: TextMeasurer):
+    """Wrap the words of lines of text between two margins.
+
+    Lines follow on from each other, like the lines of a submission.
+    Args:
+        lines: Text to lay out.
+        font: Font the text is drawn with.
+        x: Horizontal position to start at.
+        y: Vertical position to start at.
+        left: Margin lines wrap back to.
+        right: Margin words may not cross.
+        line_height: Distance between the top of consecutive lines.
+        measurer: Text measurer.
+    Returns:
+        Position of every word, and the position after the last word.
+    """
+    words = []
+    for line in lines:
+        for word in _split_words(line):
+            word_width = measurer.width(font, word + " ")
+            if x + word_width > right and x > left:
+                x = left
+                y = y + line_height
+            words.append(((x, y), word))
+            x = x + word_width
+    return words, x, y
+
+
+def layout_comment_chains(comment_chains: List[List],
+                          text_lists: List[List[List[str]]],
+                          fonts: CommentFonts, text_font_size: int,
+                          image_max_length: int, image_max_height: int,
+                          indent: int = COMMENT_INDENT,
+                          measurer: TextMeasurer = None) -> PageModel:
+    """Lay out reddit comment chains into pages without drawing them.
+
+    Every chain starts on a fresh page, each reply in a chain is indented
+    one step further than the comment it replies to, up to a limit. Every
+    comment starts with a header naming its author and score, followed by
+    its sentences with one frame per sentence. Comments without sentences
+    are left out. A sentence that does not fit on the rest of a page moves
+    to a fresh page, keeping its indentation, and a sentence taller than a
+    page is split into one frame per page.
+    Args:
+        comment_chains: Chains of comments, each chain in reply order.
+        text_lists: Sentences of every comment in every chain.
+        fonts: Fonts to lay out the comments with.
+        text_font_size: Font size of the comment text.
+        image_max_length: Length of the image frame.
+        image_max_height: Height of the image frame.
+        indent: Horizontal offset of each level of replies.
+        measurer: Text measurer, shared to reuse measurements across calls.
+    Returns:
+        Page model of the comment chains.
+    """
+    if measurer is None:
+        measurer = TextMeasurer()
+    model = PageModel()
+    line_height = text_font_size + 15
+    header_height = fonts.author.size + 15
+    bottom = image_max_height - 15
+
+    for chain, chain_text_lists in zip(comment_chains, text_lists):
+        if not chain:
+            continue
+        operations = model.new_page()
+        y = COMMENT_MARGIN
+        depth = 0
+        for comment, sentences in zip(chain, chain_text_lists):
+            if not sentences:
+                continue
+            left = max(COMMENT_MARGIN, min(
+                COMMENT_MARGIN + min(depth, MAX_COMMENT_DEPTH) * indent,
+                image_max_length - MIN_COMMENT_WIDTH
+            ))
+            depth += 1
+            header = TextOperation(
+                (left, y), "u/%s  %s points" % (comment.author, comment.score),
+                fonts.author, AUTHOR_FILL
+            )
+            x, text_y = left, y + header_height
+            pending = [header]
+            for sentence in sentences:
+                # Lay the sentence out where the comment left off, with a
+                # gap before new paragraphs.
+                lines = sentence.splitlines()
+                if '' in lines:
+                    lines = [line for line in lines if line != '']
+                    x = left
+                    text_y = text_y + 15 + text_font_size * 2
+                words, end_x, end_y = _flow_lines(
+                    lines, fonts.text, x, text_y, left, image_max_length,
+                    line_height, measurer
+                )
+
+                # Move to a fresh page if the sentence runs off this one,
+                # carrying the comment header along if it is not drawn yet.
+                if end_y + text_font_size > bottom and operations:
+                    operations = model.new_page()
+                    text_y = COMMENT_MARGIN
+                    if pending:
+                        pending = [header._replace(xy=(left, text_y))]
+                        text_y = text_y + header_height
+                    words, end_x, end_y = _flow_lines(
+                        lines, fonts.text, left, text_y, left,
+                        image_max_length, line_height, measurer
+                    )
+                operations.extend(pending)
+                pending = []
+
+                # Split a sentence taller than a page over fresh pages, each
+                # page gets a frame speaking the words on it.
+                shift, page_words = 0, []
+                for (word_x, word_y), word in words:
+                    if (word_y - shift + text_font_size > bottom
+                            and page_words):
+                        model.add_frame(" ".join(page_words))
+                        operations = model.new_page()
+                        shift = word_y - COMMENT_MARGIN
+                        page_words = []
+                    operations.append(TextOperation(
+                        (word_x, word_y - shift), word, fonts.text, TEXT_FILL
+                    ))
+                    page_words.append(word)
+                x, text_y = end_x, end_y - shift
+                model.add_frame(sentence if shift == 0
+                                else " ".join(page_words))
+            y = text_y + line_height + 15
+
+    return model
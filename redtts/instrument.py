@@ -0,0 +1,262 @@
+from typing import Dict, Iterable, Iterator, List
+import collections
+import contextlib
+import glob
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+
+# Directory every process of an instrumented run records its spans to, None
+# while instrumentation is disabled.
+_DIRECTORY = None
+_LOCK = threading.Lock()
+
+
+class Span(object):
+    """Measurements of one stage of a run."""
+
+    __slots__ = (
+        "name", "segment", "start", "end", "wall", "cpu", "child_cpu",
+        "peak_rss", "bytes_written", "items", "pid", "tid"
+    )
+
+    def __init__(self, name: str, segment=None):
+        """ Initialize span.
+
+        Args:
+            name: Name of the stage.
+            segment: Index of the config segment the stage belongs to, None
+                for stages of the whole run.
+        """
+        self.name = name
+        self.segment = segment
+        self.start = time.time()
+        self.end = self.start
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.child_cpu = 0.0
+        self.peak_rss = 0
+        self.bytes_written = 0
+        self.items = None
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+def _peak_rss() -> int:
+    """Peak resident set size in bytes of this process and its children."""
+    scale = 1 if sys.platform == "darwin" else 1024
+    return scale * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+
+
+def _child_cpu() -> float:
+    """CPU time of finished child processes, such as ffmpeg."""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def _size(path: str) -> int:
+    """Size in bytes of a file, or of every file under a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def enable(directory: str):
+    """Start recording spans of this process to a directory.
+
+    Every process of a run records to the same directory, each to its own
+    file, so spans of segments rendered in worker processes are collected
+    without sending them back.
+    Args:
+        directory: Where to record spans.
+    """
+    global _DIRECTORY
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    _DIRECTORY = directory
+
+
+def enabled() -> bool:
+    """Whether spans are being recorded."""
+    return _DIRECTORY is not None
+
+
+def _record(span: Span):
+    """Append a finished span to this process's record."""
+    with _LOCK:
+        filename = os.path.join(_DIRECTORY, "spans_%s.jsonl" % span.pid)
+        with open(filename, "a") as f:
+            f.write(json.dumps(span.to_dict()) + "\n")
+
+
+@contextlib.contextmanager
+def span(name: str, segment=None, output: str = None) -> Iterator[Span]:
+    """Measure a stage of the run.
+
+    Records wall time, CPU time of the process and of children that finished
+    during the stage, the peak RSS reached so far and the bytes under
+    output. Does nothing while instrumentation is disabled.
+    Args:
+        name: Name of the stage.
+        segment: Index of the config segment the stage belongs to.
+        output: File or directory the stage writes, measured afterwards.
+    Yields:
+        The span, set its items to the number of things the stage handled.
+    """
+    record = Span(name, segment)
+    if not enabled():
+        yield record
+        return
+    wall, cpu, child_cpu = time.perf_counter(), time.process_time(), \
+        _child_cpu()
+    try:
+        yield record
+    finally:
+        record.wall = time.perf_counter() - wall
+        record.end = time.time()
+        record.cpu = time.process_time() - cpu
+        record.child_cpu = _child_cpu() - child_cpu
+        record.peak_rss = _peak_rss()
+        if output is not None and os.path.exists(output):
+            record.bytes_written = _size(output)
+        _record(record)
+
+
+def timed_iter(iterable: Iterable, name: str, segment=None) -> Iterator:
+    """Measure the time spent producing the items of an iterable.
+
+    For stages that stream, the wall time covers only the time spent inside
+    the iterable, not the time its consumer spends on each item, while the
+    span runs from the first item being asked for to the iterable running
+    out. CPU time is that of the producing thread.
+    Args:
+        iterable: Stage to measure, typically a generator.
+        name: Name of the stage.
+        segment: Index of the config segment the stage belongs to.
+    Yields:
+        The items of the iterable.
+    """
+    if not enabled():
+        yield from iterable
+        return
+    record = Span(name, segment)
+    record.items = 0
+    iterator = iter(iterable)
+    while True:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            record.wall += time.perf_counter() - wall
+            record.cpu += time.thread_time() - cpu
+        record.items += 1
+        yield item
+    record.end = time.time()
+    record.peak_rss = _peak_rss()
+    _record(record)
+
+
+def load_spans(directory: str) -> List[Dict]:
+    """Load the spans every process recorded, ordered by start time."""
+    spans = []
+    for filename in glob.glob(os.path.join(directory, "spans_*.jsonl")):
+        with open(filename) as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    spans.sort(key=lambda x: x["start"])
+    return spans
+
+
+def write_report(directory: str, filename: str):
+    """Write a JSON report of a run.
+
+    The report lists every span, with totals per stage and per segment.
+    The totals of a segment add up its stages, the span around the whole
+    segment is reported separately as its elapsed time, stages that run
+    concurrently overlap within it.
+    Args:
+        directory: Where the spans were recorded.
+        filename: Where to store the report.
+    """
+    spans = load_spans(directory)
+    stages = collections.OrderedDict()
+    segments = collections.OrderedDict()
+    for record in spans:
+        for totals, key in ((stages, record["name"]),
+                            (segments, record["segment"])):
+            if key is None:
+                continue
+            total = totals.setdefault(key, {
+                "count": 0, "wall": 0.0, "cpu": 0.0, "child_cpu": 0.0,
+                "bytes_written": 0, "items": 0, "peak_rss": 0
+            })
+            if totals is segments and record["name"] == "segment":
+                # Encloses the other spans of the segment, adding it in
+                # would count them twice.
+                total["elapsed"] = total.get("elapsed", 0.0) + record["wall"]
+                total["peak_rss"] = max(total["peak_rss"], record["peak_rss"])
+                continue
+            total["count"] += 1
+            total["wall"] += record["wall"]
+            total["cpu"] += record["cpu"]
+            total["child_cpu"] += record["child_cpu"]
+            total["bytes_written"] += record["bytes_written"]
+            total["items"] += record["items"] or 0
+            total["peak_rss"] = max(total["peak_rss"], record["peak_rss"])
+    report = {
+        "stages": stages,
+        "segments": {str(key): value for key, value in segments.items()},
+        "spans": spans
+    }
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def write_chrome_trace(directory: str, filename: str):
+    """Write the spans of a run as a Chrome trace.
+
+    Open the file in chrome://tracing or Perfetto to see how stages overlap
+    across processes and threads. Every stage covers the time from its start
+    to its end, for streamed stages the time spent producing items is in
+    its wall arg.
+    Args:
+        directory: Where the spans were recorded.
+        filename: Where to store the trace.
+    """
+    events = []
+    for record in load_spans(directory):
+        name = record["name"]
+        if record["segment"] is not None:
+            name += " %s" % record["segment"]
+        events.append({
+            "name": name, "cat": record["name"], "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": (record["end"] - record["start"]) * 1e6,
+            "pid": record["pid"], "tid": record["tid"],
+            "args": {
+                key: record[key] for key in (
+                    "wall", "cpu", "child_cpu", "peak_rss", "bytes_written",
+                    "items"
+                )
+            }
+        })
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": events}, f)
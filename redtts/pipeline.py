@@ -0,0 +1,71 @@
+from typing import Iterable, Iterator
+import queue
+import threading
+
+
+# Number of items a stage may run ahead of the stage consuming it.
+QUEUE_SIZE = 8
+
+# Marks the end of a stage's output.
+_DONE = object()
+
+
+class _Failure(object):
+    """Exception raised by a stage, re-raised in the consuming thread."""
+
+    def __init__(self, error: BaseException):
+        super(_Failure, self).__init__()
+        self.error = error
+
+
+def iter_in_thread(iterable: Iterable, maxsize=QUEUE_SIZE) -> Iterator:
+    """Run a stage in a background thread, streaming its output.
+
+    The stage produces items while the caller consumes the ones already
+    produced. The queue between them is bounded, so a fast stage blocks
+    instead of piling up items in memory.
+    Args:
+        iterable: Stage to run, typically a generator.
+        maxsize: Most items produced ahead of the consumer.
+    Yields:
+        The items of the iterable, in order.
+    Raises:
+        Exception: Whatever the stage raised, once the items produced
+            before it are consumed.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Give up if the consumer went away, rather than blocking on a full
+        # queue forever.
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
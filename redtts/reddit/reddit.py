@@ -1,89 +1,122 @@
 from typing import List
+import heapq
 import praw
 import random
 from redtts.reddit import reddit_utils as ru
+from redtts.reddit.store import SubmissionStore
 
 
 class ContentGenerator(object):
     """Content generator for selecting what content is the most relevant."""
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, reddit: praw.Reddit = None,
+                 submission: praw.models.Submission = None,
+                 store: SubmissionStore = None):
         """ Initialize content generator instance.
 
         Content generator class determines which comments and material from
         a given reddit submission is the most relevant.
         Args:
             url: The url of the specfic submission.
+            reddit: Praw Reddit instance, defaults to the instance shared by
+                the process.
+            submission: Already fetched submission of the url, such as one
+                from a batched fetch.
+            store: Local store to serve the submission from, submissions
+                missing from it are fetched and stored.
         """
         super(ContentGenerator, self).__init__()
         self.url = url
 
-        # Instantiate reddit instance and query submission.
-        self.reddit = ru.initialize_reddit_instance()
-        self.submission = ru.get_submission_from_url(
-            url=url, reddit=self.reddit
-        )
+        # Reuse the shared reddit instance and query submission.
+        if reddit is None:
+            reddit = ru.get_reddit_instance()
+        self.reddit = reddit
+        if submission is None and store is not None:
+            submission = store.get_submissions_from_urls(
+                [url], reddit=self.reddit
+            )[0]
+        if submission is None:
+            submission = ru.get_submission_from_url(
+                url=url, reddit=self.reddit
+            )
+        self.submission = submission
 
     def get_curated_comment_chains(
             self, num_chains: int, min_chain_length: int,
             max_chain_length: int, min_character_limit=10,
-            max_character_limit=1000) -> List[List[praw.models.Comment]]:
+            max_character_limit=1000,
+            rng: random.Random = None) -> List[List[praw.models.Comment]]:
         """Get relevant comment chains
 
         Given current submission, decide which comment chains to expose. For
         now no forking in chains, comment chain encapsulates its own thread.
+        Chains start at the highest scoring top level comments and follow
+        the highest scoring direct reply down, only the comments a chain
+        visits are inspected.
         Args:
             num_chains: Number of comment chains.
             min_chain_length: Minimum number of comments in each chain.
             min_character_limit: Maximum number of comments in each chain.
             max_character_limit: Maximum length a comment is allowed to be.
+            rng: Random generator of the chain lengths, defaults to one
+                seeded by the submission id so a submission gets the same
+                chains on every run.
         Returns:
             List of list, where each nested list is composed of reddit
             comment objects.
         """
+        if rng is None:
+            rng = random.Random(self.submission.id)
         curated_comment_chains = []
 
-        # Iterate through the comment forest.
-        comment_forest = self.submission.comments.list()
-        comment_forest = [comment for comment in comment_forest if
-                          isinstance(comment, praw.models.Comment)]
-
-        # Sort the forest based on score of root comment.
-        comment_forest.sort(key=lambda x: x.score, reverse=True)
+        # Heap of the top level comments by score, roots are popped only as
+        # chains need them instead of sorting the whole forest. Collapsed
+        # "load more comments" stubs are never expanded.
+        roots = [
+            (-comment.score, i, comment)
+            for i, comment in enumerate(self.submission.comments)
+            if not isinstance(comment, praw.models.MoreComments)
+        ]
+        heapq.heapify(roots)
 
         # Construct the chains.
-        current_root = 0
         for chain in range(num_chains):
             # Generate a random chain length in accordance with the bounds.
-            chain_length = random.randint(min_chain_length, max_chain_length)
+            chain_length = rng.randint(min_chain_length, max_chain_length)
             if chain_length == 0:
                 continue
 
             # Find first valid root to traverse down.
             current_comment = None
             curated_comment_chains.append([])
-            for i in range(current_root, len(comment_forest)):
-                if (min_character_limit <= len(comment_forest[i].body)
-                        <= max_character_limit):
-                    current_root = i + 1
-                    current_comment = comment_forest[i]
+            while roots:
+                _, _, root = heapq.heappop(roots)
+                if _is_valid_comment(
+                        root, min_character_limit, max_character_limit):
+                    current_comment = root
                     break
 
-            # Complete the chain.
+            # Complete the chain, following the best valid reply down.
             if current_comment is not None:
-                curated_comment_chains[chain].append(current_comment)
-                # Chose a random int to make the chain length.
+                curated_comment_chains[-1].append(current_comment)
                 for i in range(1, chain_length):
-                    replies = current_comment.replies.list()
-                    replies = [reply for reply in replies if
-                               isinstance(reply, praw.models.Comment)]
-                    replies.sort(key=lambda x: x.score, reverse=True)
-                    # Find first valid comment.
-                    for reply in replies:
-                        if (min_character_limit <= len(reply.body)
-                                <= max_character_limit):
-                            curated_comment_chains[chain].append(reply)
-                            current_comment = reply
-                            break
+                    replies = [
+                        reply for reply in current_comment.replies
+                        if not isinstance(reply, praw.models.MoreComments)
+                        and _is_valid_comment(
+                            reply, min_character_limit, max_character_limit
+                        )
+                    ]
+                    if not replies:
+                        break
+                    current_comment = max(replies, key=lambda x: x.score)
+                    curated_comment_chains[-1].append(current_comment)
 
         return curated_comment_chains
+
+
+def _is_valid_comment(comment, min_character_limit: int,
+                      max_character_limit: int) -> bool:
+    """Whether a comment's length is within the character limits."""
+    return min_character_limit <= len(comment.body) <= max_character_limit
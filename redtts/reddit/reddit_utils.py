@@ -1,12 +1,20 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List
+import collections
+import functools
+import json
+import os
 import praw
-import urllib
+import requests
+import threading
+import time
 
 
-PUSHSHIFT_URL = "https://api.pushshift.io/reddit/submission/search/?subreddit="
-READ_CHAR = read_char = [
-    ' ', '{', '}', '\'', '\\n', '"created_utc"', '"data"', ':', '[', ']'
-]
+PUSHSHIFT_URL = "https://api.pushshift.io/reddit/submission/search/"
+# Most submissions pushshift returns per request.
+PUSHSHIFT_PAGE_SIZE = 1000
+# Most things reddit's info endpoint returns per request.
+INFO_BATCH_SIZE = 100
 
 
 def initialize_reddit_instance(read_only=True) -> praw.Reddit:
@@ -30,6 +38,217 @@ def initialize_reddit_instance(read_only=True) -> praw.Reddit:
     return reddit
 
 
+@functools.lru_cache(maxsize=None)
+def get_reddit_instance(read_only=True) -> praw.Reddit:
+    """Get the Reddit instance shared by the whole process.
+
+    Reusing one instance reuses its authentication and HTTP connections
+    instead of setting them up again for every submission.
+    Args:
+        read_only: Whether the instance is read only.
+    Returns:
+        A praw Reddit instance.
+    """
+    return initialize_reddit_instance(read_only=read_only)
+
+
+class RateLimiter(object):
+    """Spaces out calls shared by many threads to a maximum rate."""
+
+    def __init__(self, requests_per_second: float):
+        """ Initialize rate limiter.
+
+        Args:
+            requests_per_second: Maximum rate of calls, zero or less
+                disables limiting.
+        """
+        super(RateLimiter, self).__init__()
+        self.interval = (
+            1.0 / requests_per_second if requests_per_second > 0 else 0
+        )
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class PushshiftClient(object):
+    """Client of the pushshift submission search API."""
+
+    def __init__(self, workers=8, requests_per_second=4, retries=3):
+        """ Initialize pushshift client.
+
+        All requests share one pooled HTTP session and one rate limit, so
+        concurrent range scans reuse connections without flooding the API.
+        Args:
+            workers: Number of requests made concurrently by range scans.
+            requests_per_second: Maximum rate of requests.
+            retries: Times a failed request is retried.
+        """
+        super(PushshiftClient, self).__init__()
+        self.workers = workers
+        self.retries = retries
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(workers, 1)
+        )
+        self.session.mount("https://", adapter)
+
+    def search(self, subreddit: str, sort="asc", size=PUSHSHIFT_PAGE_SIZE,
+               after: int = None, before: int = None) -> List[Dict]:
+        """Search the submissions of a subreddit.
+
+        Args:
+            subreddit: The subreddit to query.
+            sort: Order of creation time, asc or desc.
+            size: Maximum number of submissions to return.
+            after: Only return submissions created after this timestamp.
+            before: Only return submissions created before this timestamp.
+        Returns:
+            List of dictionaries with the id and created_utc of submissions.
+        """
+        params = {
+            "subreddit": subreddit, "sort": sort, "size": size,
+            "filter": "id,created_utc"
+        }
+        if after is not None:
+            params["after"] = after
+        if before is not None:
+            params["before"] = before
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            try:
+                response = self.session.get(
+                    PUSHSHIFT_URL, params=params, timeout=30
+                )
+                response.raise_for_status()
+                return response.json()["data"]
+            except (requests.RequestException, ValueError):
+                if attempt == self.retries:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def scan(self, subreddit: str, start_time: int,
+             end_time: int) -> Iterator[List[Dict]]:
+        """Page through the submissions of a time range, oldest first.
+
+        Args:
+            subreddit: The subreddit to query.
+            start_time: Unixtimestamp in seconds of the start range.
+            end_time: Unixtimestamp in seconds of the end range.
+        Yields:
+            Pages of submissions, as returned by search.
+        """
+        # Pages overlap by one second so posts sharing the timestamp of the
+        # end of a page are not skipped, ids already seen are dropped.
+        after = start_time - 1
+        seen = set()
+        while True:
+            page = self.search(
+                subreddit, after=after, before=end_time
+            )
+            new = [post for post in page if post["id"] not in seen]
+            if not new:
+                if len(page) < PUSHSHIFT_PAGE_SIZE:
+                    return
+                # A whole page shares one timestamp, move past it.
+                after = page[-1]["created_utc"]
+                continue
+            yield new
+            if len(page) < PUSHSHIFT_PAGE_SIZE:
+                return
+            after = page[-1]["created_utc"] - 1
+            seen = {
+                post["id"] for post in page
+                if post["created_utc"] == page[-1]["created_utc"]
+            }
+
+    def _scan_shard(self, subreddit: str, start_time: int,
+                    end_time: int) -> List[str]:
+        """Get the ids of every submission in a time range."""
+        ids = []
+        for page in self.scan(subreddit, start_time, end_time):
+            ids.extend(post["id"] for post in page)
+        return ids
+
+    def iter_ids_in_range(self, subreddit: str, start_time: int,
+                          end_time: int, num_shards: int = None,
+                          checkpoint: str = None,
+                          verbose=False) -> Iterator[str]:
+        """Yield the id of every submission in a time range.
+
+        The range is split into shards of equal duration which are scanned
+        concurrently, ids are yielded in creation order as each shard
+        completes. Completed shards are recorded in a checkpoint file, a
+        scan of the same range resumes after the last recorded shard.
+        Args:
+            subreddit: The subreddit to query.
+            start_time: Unixtimestamp in seconds of the start range.
+            end_time: Unixtimestamp in seconds of the end range.
+            num_shards: Number of shards, defaults to four per worker.
+            checkpoint: JSON file recording completed shards, None to not
+                checkpoint.
+            verbose: Whether to output percentage of posts queried.
+        Yields:
+            String ids.
+        """
+        if num_shards is None:
+            num_shards = max(self.workers, 1) * 4
+        num_shards = max(1, min(num_shards, end_time - start_time))
+        bounds = [
+            start_time + (end_time - start_time) * i // num_shards
+            for i in range(num_shards + 1)
+        ]
+
+        # Resume from the checkpoint of the same scan, if any.
+        plan = [subreddit, start_time, end_time, num_shards]
+        completed = 0
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state["plan"] == plan:
+                completed = state["completed"]
+
+        # Keep a bounded number of shards in flight so memory does not grow
+        # with the size of the range.
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            pending = collections.deque()
+            next_shard = completed
+            for shard in range(completed, num_shards):
+                while (next_shard < num_shards
+                       and len(pending) < 2 * max(self.workers, 1)):
+                    pending.append(executor.submit(
+                        self._scan_shard, subreddit, bounds[next_shard],
+                        bounds[next_shard + 1]
+                    ))
+                    next_shard += 1
+                for sub_id in pending.popleft().result():
+                    yield sub_id
+
+                if checkpoint is not None:
+                    tmp_checkpoint = checkpoint + ".tmp"
+                    with open(tmp_checkpoint, "w") as f:
+                        json.dump({"plan": plan, "completed": shard + 1}, f)
+                    os.replace(tmp_checkpoint, checkpoint)
+                if verbose:
+                    percentage = (shard + 1) / num_shards * 100
+                    print(str(round(percentage, 2)) + '%', end='\r')
+
+
+@functools.lru_cache(maxsize=None)
+def get_pushshift_client() -> PushshiftClient:
+    """Get the pushshift client shared by the whole process."""
+    return PushshiftClient()
+
+
 def get_first_post_timestamp(subreddit: str) -> int:
     """Get the first posts timestamp of a particular subreddit.
 
@@ -39,38 +258,21 @@ def get_first_post_timestamp(subreddit: str) -> int:
     Returns:
         Unixtimestamp in seconds of the first post in the subreddit
     """
-    # Getting the timestamp of first post on the subreddit.
-    ps = urllib.request.urlopen(
-        PUSHSHIFT_URL + subreddit + "&sort=asc&filter=created_utc&size=1"
-    )
-    htmltext = ps.read()
-    htmltext = str(htmltext)
-    htmltext = htmltext[1:]
-    for c in READ_CHAR:
-        htmltext = htmltext.replace(c, '')
-    first_post_timestamp = int(htmltext)
-    return first_post_timestamp
+    posts = get_pushshift_client().search(subreddit, sort="asc", size=1)
+    return int(posts[0]["created_utc"])
 
 
 def get_last_post_timestamp(subreddit: str) -> int:
     """Get the last posts timestamp of a particular subreddit.
 
-    Using pushshift API access the timestamp of the ;ast post.
+    Using pushshift API access the timestamp of the last post.
     Args:
         subreddit: The subreddit to query.
     Returns:
         Unixtimestamp in seconds of the last post in the subreddit
     """
-    ps = urllib.request.urlopen(
-        PUSHSHIFT_URL+subreddit+"&sort=desc&filter=created_utc&size=1"
-    )
-    htmltext = ps.read()
-    htmltext = str(htmltext)
-    htmltext = htmltext[1:]
-    for c in READ_CHAR:
-        htmltext = htmltext.replace(c, '')
-    last_post_timestamp = int(htmltext)
-    return last_post_timestamp
+    posts = get_pushshift_client().search(subreddit, sort="desc", size=1)
+    return int(posts[0]["created_utc"])
 
 
 def get_timestamps_in_range(
@@ -89,23 +291,11 @@ def get_timestamps_in_range(
     Returns:
         List of unixtimestamps.
     """
-    timestamp = start_time
     timestamps = []
-    while timestamp < end_time:
-        timestamps.append(timestamp)
-        ps = urllib.request.urlopen(
-            PUSHSHIFT_URL + subreddit + "&sort=asc&filter=created_utc&after="
-            + str(timestamp) + "&size=1000"
-        )
-        htmltext = ps.read()
-        htmltext = str(htmltext)
-        htmltext = htmltext[1:]
-        for c in READ_CHAR:
-            htmltext = htmltext.replace(c, '')
-        array = htmltext.split(',')
-        timestamp = int(array[-1])
+    for page in get_pushshift_client().scan(subreddit, start_time, end_time):
+        timestamps.append(int(page[0]["created_utc"]))
         if verbose:
-            percentage = (timestamp - start_time) / (
+            percentage = (page[-1]["created_utc"] - start_time) / (
                     end_time - start_time) * 100
             print(str(round(percentage, 2)) + '%', end='\r')
     return timestamps
@@ -117,7 +307,8 @@ def get_ids_in_range(
     """Get list of string id's in time range.
 
     Given a start and end time, get a list of id's of every submission for
-    the specified subreddt.
+    the specified subreddt. Use PushshiftClient.iter_ids_in_range directly
+    to stream ids or resume from a checkpoint.
     Args:
         subreddit: The subreddit to query.
         start_time: Unixtimestamp in seconds of the start range.
@@ -126,26 +317,9 @@ def get_ids_in_range(
     Returns:
         List of string id's
     """
-    id_list = []
-    timestamps = get_timestamps_in_range(
-        subreddit, start_time, end_time, verbose=False
-    )
-    for timestamp in timestamps:
-        ps = urllib.request.urlopen(
-            PUSHSHIFT_URL + subreddit + "&sort=asc&filter=id&after="
-            + str(timestamp) + "&size=1000"
-        )
-        htmltext = ps.read()
-        htmltext = str(htmltext)
-        htmltext = htmltext[1:]
-        for c in [' ','{','}','\'','\\n','"id"','"data"',':','[',']','"']:
-            htmltext = htmltext.replace(c, '')
-        id_list = id_list + htmltext.split(',')
-        if verbose:
-            percentage = (timestamp - start_time) / (
-                        end_time - start_time) * 100
-            print(str(round(percentage, 2)) + '%', end='\r')
-    return id_list
+    return list(get_pushshift_client().iter_ids_in_range(
+        subreddit, start_time, end_time, verbose=verbose
+    ))
 
 
 def get_submissions_from_ids(
@@ -153,25 +327,54 @@ def get_submissions_from_ids(
         reddit: praw.Reddit, verbose=False) -> List[praw.models.Submission]:
     """Get list of praw Submission objects.
 
-    Given an id list get submission objects associated with said id's
+    Given an id list get submission objects associated with said id's.
+    Submissions are fetched in batches through reddit's info endpoint, so
+    they come back with their attributes populated rather than each
+    triggering its own request on first access.
     Args:
         id_list: List of str id's associated with reddit posts.
         reddit: Praw Reddit instance.
         verbose: Whether to output percentage of posts queried.
     Returns:
-        List of praw Submission objects.
+        List of praw Submission objects, in the order of id_list.
     """
-    submission_list = []
-    current = 0
+    fetched = {}
     total_submissions = len(id_list)
-    for sub_id in id_list:
-        sub = reddit.submission(id=sub_id)
-        submission_list.append(sub)
-        current += 1
+    for start in range(0, total_submissions, INFO_BATCH_SIZE):
+        fullnames = [
+            "t3_" + sub_id for sub_id in
+            id_list[start:start + INFO_BATCH_SIZE]
+        ]
+        for sub in reddit.info(fullnames=fullnames):
+            fetched[sub.id] = sub
         if verbose:
+            current = min(start + INFO_BATCH_SIZE, total_submissions)
             percentage = current / total_submissions * 100
             print(str(round(percentage, 2)) + '%', end='\r')
-    return submission_list
+
+    # Reddit leaves out posts it can not return, keep those lazy as before.
+    return [
+        fetched[sub_id] if sub_id in fetched
+        else reddit.submission(id=sub_id) for sub_id in id_list
+    ]
+
+
+def get_submissions_from_urls(
+        urls: List[str],
+        reddit: praw.Reddit, verbose=False) -> List[praw.models.Submission]:
+    """Get list of praw Submission objects from urls.
+
+    Given a url list get submission objects associated with said urls, in
+    batches.
+    Args:
+        urls: List of submission urls.
+        reddit: Praw Reddit instance.
+        verbose: Whether to output percentage of posts queried.
+    Returns:
+        List of praw Submission objects, in the order of urls.
+    """
+    id_list = [praw.models.Submission.id_from_url(url) for url in urls]
+    return get_submissions_from_ids(id_list, reddit, verbose=verbose)
 
 
 def get_submission_from_url(
@@ -0,0 +1,233 @@
+from typing import Dict, List, Optional
+from redtts.reddit import reddit_utils as ru
+import json
+import os
+import praw
+import sqlite3
+import time
+import zlib
+
+
+class StoredSubreddit(object):
+    """Subreddit of a stored submission."""
+
+    def __init__(self, display_name: str):
+        """ Initialize stored subreddit.
+
+        Args:
+            display_name: Name of the subreddit.
+        """
+        super(StoredSubreddit, self).__init__()
+        self.display_name = display_name
+
+    def __str__(self):
+        return self.display_name
+
+
+class StoredCommentForest(list):
+    """Replies of a stored submission or comment, top level first."""
+
+    def list(self) -> List["StoredComment"]:
+        """Get every comment of the forest, breadth first like praw."""
+        comments = []
+        queue = list(self)
+        while queue:
+            comment = queue.pop(0)
+            comments.append(comment)
+            queue.extend(comment.replies)
+        return comments
+
+
+class StoredComment(object):
+    """Snapshot of a reddit comment and its replies."""
+
+    def __init__(self, data: Dict):
+        """ Initialize stored comment.
+
+        Args:
+            data: Snapshot of the comment, as made by snapshot_comment.
+        """
+        super(StoredComment, self).__init__()
+        self.id = data["id"]
+        self.author = data["author"]
+        self.body = data["body"]
+        self.score = data["score"]
+        self.replies = StoredCommentForest(
+            StoredComment(reply) for reply in data["replies"]
+        )
+
+
+class StoredSubmission(object):
+    """Snapshot of a reddit submission and its comment tree.
+
+    Exposes the attributes of a praw Submission the pipeline reads, so it
+    can be used in place of one.
+    """
+
+    def __init__(self, data: Dict):
+        """ Initialize stored submission.
+
+        Args:
+            data: Snapshot of the submission, as made by snapshot_submission.
+        """
+        super(StoredSubmission, self).__init__()
+        self.id = data["id"]
+        self.url = data["url"]
+        self.title = data["title"]
+        self.selftext = data["selftext"]
+        self.score = data["score"]
+        self.author = data["author"]
+        self.subreddit = StoredSubreddit(data["subreddit"])
+        self.comments = StoredCommentForest(
+            StoredComment(comment) for comment in data["comments"]
+        )
+
+
+def _author(item) -> Optional[str]:
+    """Name of the author of a submission or comment, None if deleted."""
+    return None if item.author is None else str(item.author)
+
+
+def snapshot_comment(comment: praw.models.Comment) -> Dict:
+    """Snapshot a comment and its loaded replies into plain data.
+
+    Args:
+        comment: Praw comment.
+    Returns:
+        Dictionary that can be stored as JSON.
+    """
+    return {
+        "id": comment.id,
+        "author": _author(comment),
+        "body": comment.body,
+        "score": comment.score,
+        "replies": [
+            snapshot_comment(reply) for reply in comment.replies
+            if not isinstance(reply, praw.models.MoreComments)
+        ]
+    }
+
+
+def snapshot_submission(submission: praw.models.Submission) -> Dict:
+    """Snapshot a submission and its loaded comment tree into plain data.
+
+    Only comments reddit returned with the submission are kept, collapsed
+    "load more comments" stubs are left out rather than fetched.
+    Args:
+        submission: Praw submission.
+    Returns:
+        Dictionary that can be stored as JSON.
+    """
+    return {
+        "id": submission.id,
+        "url": submission.url,
+        "title": submission.title,
+        "selftext": submission.selftext,
+        "score": submission.score,
+        "author": _author(submission),
+        "subreddit": submission.subreddit.display_name,
+        "comments": [
+            snapshot_comment(comment) for comment in submission.comments
+            if not isinstance(comment, praw.models.MoreComments)
+        ]
+    }
+
+
+class SubmissionStore(object):
+    """Local SQLite store of submissions and their comment trees."""
+
+    def __init__(self, filename: str, offline=False):
+        """ Initialize submission store.
+
+        Submissions are kept as compressed JSON snapshots keyed by id, so
+        re-rendering a post never goes back to reddit for it.
+        Args:
+            filename: SQLite database file.
+            offline: Whether to only replay stored submissions, missing
+                submissions raise instead of being fetched.
+        """
+        super(SubmissionStore, self).__init__()
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        self.offline = offline
+
+        # Segments rendered in other processes write to the same database.
+        self.connection = sqlite3.connect(filename, timeout=60)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS submissions ("
+                "id TEXT PRIMARY KEY, fetched_utc REAL, data BLOB)"
+            )
+
+    def get(self, submission_id: str) -> Optional[StoredSubmission]:
+        """Look up a stored submission.
+
+        Args:
+            submission_id: Reddit id of the submission.
+        Returns:
+            The stored submission, None if not stored.
+        """
+        row = self.connection.execute(
+            "SELECT data FROM submissions WHERE id = ?", (submission_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return StoredSubmission(json.loads(zlib.decompress(row[0])))
+
+    def put(self, submission: praw.models.Submission) -> StoredSubmission:
+        """Snapshot a submission into the store.
+
+        Args:
+            submission: Praw submission, its comments are fetched if they
+                were not loaded yet.
+        Returns:
+            The stored submission.
+        """
+        data = snapshot_submission(submission)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO submissions VALUES (?, ?, ?)",
+                (data["id"], time.time(),
+                 zlib.compress(json.dumps(data).encode("utf-8")))
+            )
+        return StoredSubmission(data)
+
+    def get_submissions_from_urls(
+            self, urls: List[str],
+            reddit: praw.Reddit = None) -> List[StoredSubmission]:
+        """Get submissions from the store, fetching the missing ones.
+
+        Missing submissions are fetched in one batch and stored.
+        Args:
+            urls: List of submission urls.
+            reddit: Praw Reddit instance, defaults to the instance shared by
+                the process.
+        Returns:
+            List of stored submissions, in the order of urls.
+        Raises:
+            KeyError: If a submission is not stored and the store is
+                offline.
+        """
+        id_list = [praw.models.Submission.id_from_url(url) for url in urls]
+        stored = {sub_id: self.get(sub_id) for sub_id in id_list}
+        missing = [
+            sub_id for sub_id, submission in stored.items()
+            if submission is None
+        ]
+        if missing and self.offline:
+            raise KeyError(
+                "Submissions %s are not stored, can not fetch them offline."
+                % ", ".join(missing)
+            )
+        if missing:
+            if reddit is None:
+                reddit = ru.get_reddit_instance()
+            for submission in ru.get_submissions_from_ids(missing, reddit):
+                stored[submission.id] = self.put(submission)
+        return [stored[sub_id] for sub_id in id_list]
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
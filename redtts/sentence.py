@@ -0,0 +1,32 @@
+class Sentence(object):
+    """A spoken sentence of a video and everything made for it.
+
+    Each stage fills in its own fields, the renderer sets the image, the
+    voice bot the audio and the stitcher the duration, so stages pass the
+    same records along instead of dictionaries keyed on sentence text.
+    """
+
+    __slots__ = ("index", "text", "image", "audio", "duration")
+
+    def __init__(self, index: int, text: str, image=None, audio: str = None,
+                 duration: float = None):
+        """ Initialize sentence.
+
+        Args:
+            index: Position of the sentence in its video, identifies the
+                sentence and the files made for it.
+            text: Text shown for the sentence.
+            image: Filename of the frame shown, or the frame itself when
+                rendering in memory.
+            audio: Filename of the spoken sentence.
+            duration: Duration of the spoken sentence in seconds.
+        """
+        self.index = index
+        self.text = text
+        self.image = image
+        self.audio = audio
+        self.duration = duration
+
+    def __repr__(self):
+        return "Sentence(%d, %r)" % (self.index, self.text)
+
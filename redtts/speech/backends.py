@@ -0,0 +1,378 @@
+from typing import List, Optional, Tuple
+import ctypes
+import ctypes.util
+import io
+import pyttsx3
+import shutil
+import subprocess
+import threading
+import wave
+
+
+# Supported text to speech backends.
+BACKENDS = ["pyttsx3", "espeak-ng"]
+
+VOICE_IDS = {
+    'Alex': 'com.apple.speech.synthesis.voice.Alex',  # US
+    'Daniel': 'com.apple.speech.synthesis.voice.daniel',  # GB
+    'Fiona': 'com.apple.speech.synthesis.voice.fiona',  # Scotland
+    'Fred': 'com.apple.speech.synthesis.voice.Fred',  # US
+    'Karen': 'com.apple.speech.synthesis.voice.karen',  # AU
+    'Moira': 'com.apple.speech.synthesis.voice.moira',  # IE
+    'Samantha': 'com.apple.speech.synthesis.voice.samantha',  # US
+    'Tessa': 'com.apple.speech.synthesis.voice.tessa',  # ZA
+    'Veena': 'com.apple.speech.synthesis.voice.veena',  # IN
+    'Victoria': 'com.apple.speech.synthesis.voice.Victoria'  # US
+}
+
+# Nearest espeak-ng voice of every supported voice, espeak-ng has no
+# Australian, Irish, South African or Indian English.
+ESPEAK_VOICES = {
+    'Alex': 'en-us',
+    'Daniel': 'en-gb',
+    'Fiona': 'en-gb-scotland+f3',
+    'Fred': 'en-us+m3',
+    'Karen': 'en-gb-x-rp+f2',
+    'Moira': 'en-gb+f4',
+    'Samantha': 'en-us+f3',
+    'Tessa': 'en-gb+f5',
+    'Veena': 'en-gb+f1',
+    'Victoria': 'en-us+f2'
+}
+
+# Sentences a pyttsx3 engine synthesizes before it is recycled, some
+# platform drivers need a value as low as 1 to avoid getting caught.
+JOBS_PER_ENGINE = 32
+
+# Words per minute espeak-ng speaks at before the rate delta.
+ESPEAK_RATE = 175
+
+# Constants of the espeak-ng C API, from speak_lib.h.
+_AUDIO_OUTPUT_SYNCHRONOUS = 2
+_POS_CHARACTER = 1
+_ESPEAK_CHARS_UTF8 = 1
+_ESPEAK_PARAMETER_RATE = 1
+_EE_OK = 0
+
+# Shared library loaded when it can not be looked up, such as in containers
+# without ldconfig.
+_ESPEAK_LIBRARY = "libespeak-ng.so.1"
+
+_SYNTH_CALLBACK = ctypes.CFUNCTYPE(
+    ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int,
+    ctypes.c_void_p
+)
+
+
+def init_engine(voice_id: str, rate_delta=0) -> pyttsx3.Engine:
+    """Initialize a text to speech engine.
+
+    Args:
+        voice_id: Engine specific id of the voice to use.
+        rate_delta: Amount to add to the default voice rate.
+    Returns:
+        A pyttsx3 engine.
+    """
+    engine = pyttsx3.init()
+    engine.setProperty('voice', voice_id)
+    engine.setProperty('rate', engine.getProperty('rate') + rate_delta)
+    return engine
+
+
+class TTSBackend(object):
+    """Text to speech engine a VoiceBot synthesizes with."""
+
+    # Extension of the audio files the backend writes.
+    extension = "wav"
+
+    def __init__(self, voice_id: str, rate_delta=0):
+        """ Initialize text to speech backend.
+
+        Args:
+            voice_id: Backend specific id of the voice, also identifies the
+                voice in the speech cache.
+            rate_delta: Amount to add to the default voice rate.
+        """
+        super(TTSBackend, self).__init__()
+        self.voice_id = voice_id
+        self.rate = rate_delta
+
+    def synthesize(self, text: str, filename: str):
+        """Synthesize text to an audio file.
+
+        Args:
+            text: Text to synthesize.
+            filename: Where to store the audio.
+        """
+        raise NotImplementedError
+
+    def synthesize_batch(self, jobs: List[Tuple[str, str]]
+                         ) -> List[Optional[float]]:
+        """Synthesize many texts to audio files.
+
+        Args:
+            jobs: List of text and filename to store the audio at pairs.
+        Returns:
+            Duration in seconds of every file, None where the backend does
+            not know it.
+        """
+        for text, filename in jobs:
+            self.synthesize(text, filename)
+        return [None] * len(jobs)
+
+    def speak(self, text: str):
+        """Speak text out loud, blocking until done."""
+        raise NotImplementedError
+
+    def reset(self):
+        """Drop the engine after a failure, the next job starts a new one."""
+        pass
+
+    def close(self):
+        """Release the engine."""
+        pass
+
+
+class Pyttsx3Backend(TTSBackend):
+    """Backend of the platform voices pyttsx3 drives."""
+
+    extension = "mp3"
+
+    def __init__(self, voice="Daniel", rate_delta=0,
+                 jobs_per_engine=JOBS_PER_ENGINE):
+        """ Initialize pyttsx3 backend.
+
+        Args:
+            voice: Name of supported voice.
+            rate_delta: Amount to add to the default voice rate.
+            jobs_per_engine: Number of sentences an engine synthesizes
+                before it is recycled.
+        """
+        assert voice in VOICE_IDS.keys()
+        super(Pyttsx3Backend, self).__init__(VOICE_IDS[voice], rate_delta)
+        self.jobs_per_engine = jobs_per_engine
+        self.completed_jobs = 0
+        self.engine = None
+
+    def _get_engine(self) -> pyttsx3.Engine:
+        """Get the engine, starting one if there is none."""
+        if self.engine is None:
+            self.engine = init_engine(self.voice_id, self.rate)
+            self.completed_jobs = 0
+        return self.engine
+
+    def synthesize(self, text: str, filename: str):
+        engine = self._get_engine()
+        engine.save_to_file(text, filename)
+        engine.runAndWait()
+
+        # The engine needs to be remade every so often to avoid getting
+        # caught.
+        self.completed_jobs += 1
+        if self.completed_jobs >= self.jobs_per_engine:
+            self.reset()
+
+    def speak(self, text: str):
+        engine = self._get_engine()
+        engine.say(text)
+        engine.runAndWait()
+
+    def reset(self):
+        self.engine = None
+
+
+class _Espeak(object):
+    """The espeak-ng library of this process.
+
+    espeak-ng keeps its state in globals, so the library is initialized once
+    per process and synthesis is serialized.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, library: str):
+        """ Initialize espeak-ng for synthesis to memory.
+
+        Args:
+            library: Filename of the shared library.
+        Raises:
+            OSError: If the library can not be loaded or initialized.
+        """
+        super(_Espeak, self).__init__()
+        self.lib = ctypes.CDLL(library)
+        self.lib.espeak_Synth.argtypes = [
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int,
+            ctypes.c_uint, ctypes.c_uint, ctypes.POINTER(ctypes.c_uint),
+            ctypes.c_void_p
+        ]
+        self.sample_rate = self.lib.espeak_Initialize(
+            _AUDIO_OUTPUT_SYNCHRONOUS, 0, None, 0
+        )
+        if self.sample_rate <= 0:
+            raise OSError("Could not initialize %s." % library)
+        self.lock = threading.Lock()
+        self.chunks = []
+
+        # Keep a reference to the callback, the library holds on to it.
+        self.callback = _SYNTH_CALLBACK(self._collect)
+        self.lib.espeak_SetSynthCallback(self.callback)
+
+    def _collect(self, wav, num_samples, events) -> int:
+        """Collect audio as espeak-ng produces it."""
+        if num_samples > 0:
+            self.chunks.append(ctypes.string_at(wav, num_samples * 2))
+        return 0
+
+    @classmethod
+    def get(cls) -> "_Espeak":
+        """Get the library of this process, loading it on first use.
+
+        Raises:
+            OSError: If the library can not be loaded or initialized.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(
+                    ctypes.util.find_library("espeak-ng") or _ESPEAK_LIBRARY
+                )
+            return cls._instance
+
+    def synthesize(self, texts: List[str], voice: str, rate: int
+                   ) -> List[bytes]:
+        """Synthesize texts to 16 bit mono PCM.
+
+        Args:
+            texts: Texts to synthesize.
+            voice: Name of the espeak-ng voice.
+            rate: Words per minute.
+        Returns:
+            PCM of every text at the library's sample rate.
+        Raises:
+            RuntimeError: If espeak-ng reports an error.
+        """
+        with self.lock:
+            if self.lib.espeak_SetVoiceByName(voice.encode()) != _EE_OK:
+                raise RuntimeError("Unknown espeak-ng voice %s." % voice)
+            self.lib.espeak_SetParameter(_ESPEAK_PARAMETER_RATE, rate, 0)
+            pcm = []
+            for text in texts:
+                data = text.encode("utf-8") + b"\0"
+                self.chunks = []
+                error = self.lib.espeak_Synth(
+                    data, len(data), 0, _POS_CHARACTER, 0,
+                    _ESPEAK_CHARS_UTF8, None, None
+                )
+                if error != _EE_OK:
+                    raise RuntimeError(
+                        "espeak-ng failed with error %d on %r." % (error, text)
+                    )
+                self.lib.espeak_Synchronize()
+                pcm.append(b"".join(self.chunks))
+            self.chunks = []
+            return pcm
+
+
+class EspeakBackend(TTSBackend):
+    """Backend of the local espeak-ng engine.
+
+    Synthesizes through the espeak-ng library, loaded once per process, so a
+    batch of sentences costs a single engine start-up. Falls back to running
+    the espeak-ng command once per sentence when only the command is
+    installed.
+    """
+
+    def __init__(self, voice="Daniel", rate_delta=0):
+        """ Initialize espeak-ng backend.
+
+        Args:
+            voice: Name of supported voice, mapped to the nearest espeak-ng
+                voice.
+            rate_delta: Amount to add to the default voice rate.
+        Raises:
+            OSError: If neither the espeak-ng library nor command is
+                installed.
+        """
+        assert voice in ESPEAK_VOICES.keys()
+        super(EspeakBackend, self).__init__(
+            "espeak-ng:" + ESPEAK_VOICES[voice], rate_delta
+        )
+        self.voice = ESPEAK_VOICES[voice]
+        self.words_per_minute = ESPEAK_RATE + rate_delta
+        try:
+            self.library = _Espeak.get()
+        except OSError:
+            self.library = None
+        self.command = shutil.which("espeak-ng")
+        if self.library is None and self.command is None:
+            raise OSError("espeak-ng is not installed.")
+
+    def _run(self, text: str, *args) -> bytes:
+        """Run the espeak-ng command on text."""
+        return subprocess.run(
+            [self.command, "-v", self.voice, "-s",
+             str(self.words_per_minute), "--stdin"] + list(args),
+            input=text.encode("utf-8"), stdout=subprocess.PIPE, check=True
+        ).stdout
+
+    def synthesize_pcm(self, texts: List[str]) -> Tuple[List[bytes], int]:
+        """Synthesize texts to 16 bit mono PCM.
+
+        Args:
+            texts: Texts to synthesize.
+        Returns:
+            PCM of every text and its sample rate.
+        """
+        if self.library is not None:
+            return self.library.synthesize(
+                texts, self.voice, self.words_per_minute
+            ), self.library.sample_rate
+        pcm, sample_rate = [], None
+        for text in texts:
+            with wave.open(io.BytesIO(self._run(text, "--stdout"))) as f:
+                sample_rate = f.getframerate()
+                pcm.append(f.readframes(f.getnframes()))
+        return pcm, sample_rate
+
+    def synthesize(self, text: str, filename: str):
+        self.synthesize_batch([(text, filename)])
+
+    def synthesize_batch(self, jobs: List[Tuple[str, str]]
+                         ) -> List[Optional[float]]:
+        if not jobs:
+            return []
+        pcm, sample_rate = self.synthesize_pcm([text for text, _ in jobs])
+        durations = []
+        for (_, filename), samples in zip(jobs, pcm):
+            with wave.open(filename, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(sample_rate)
+                f.writeframes(samples)
+            durations.append(len(samples) / 2.0 / sample_rate)
+        return durations
+
+    def speak(self, text: str):
+        assert self.command is not None, "Speaking requires espeak-ng."
+        self._run(text)
+
+
+def make_backend(name: str, voice="Daniel", rate_delta=0,
+                 jobs_per_engine=JOBS_PER_ENGINE) -> TTSBackend:
+    """Make a text to speech backend.
+
+    Args:
+        name: Name of the backend, one of BACKENDS.
+        voice: Name of supported voice.
+        rate_delta: Amount to add to the default voice rate.
+        jobs_per_engine: Number of sentences an engine synthesizes before it
+            is recycled, if the backend recycles engines.
+    Returns:
+        The backend.
+    """
+    assert name in BACKENDS
+    if name == "espeak-ng":
+        return EspeakBackend(voice=voice, rate_delta=rate_delta)
+    return Pyttsx3Backend(
+        voice=voice, rate_delta=rate_delta, jobs_per_engine=jobs_per_engine
+    )
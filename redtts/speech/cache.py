@@ -0,0 +1,19 @@
+from .. import utils
+from ..cache import FileCache
+
+
+class SpeechCache(FileCache):
+    """Content addressed on disk cache of synthesized speech files."""
+
+    @staticmethod
+    def key(text: str, voice_id: str, rate: int) -> str:
+        """Compute the cache key of a synthesized sentence.
+
+        Args:
+            text: Preprocessed text handed to the engine.
+            voice_id: Engine specific id of the voice.
+            rate: Rate adjustment of the voice.
+        Returns:
+            Hex digest identifying the speech file.
+        """
+        return utils.hash_inputs(text, voice_id, rate)
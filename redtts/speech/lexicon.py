@@ -0,0 +1,138 @@
+from typing import Dict, List, Pattern
+from .. import utils
+import functools
+import json
+import os
+import re
+
+
+# Directory of the lexicons, default.json applies to every subreddit and
+# <subreddit>.json, lowercased, to that subreddit only.
+LEXICON_PATH = os.path.join(utils.get_asset_filepath(), "lexicons")
+
+
+def _trie_pattern(trie: Dict) -> str:
+    """Build the pattern matching every word of a trie.
+
+    Words sharing a prefix share its branch, so the regex engine follows
+    one branch per character instead of trying every word in turn.
+    Args:
+        trie: Nested dictionaries of characters, "" marks the end of a word.
+    Returns:
+        Pattern matching the words of the trie, empty if only the end
+        marker is left.
+    """
+    branches, chars = [], []
+    for char in sorted(key for key in trie if key):
+        rest = _trie_pattern(trie[char])
+        if rest:
+            branches.append(re.escape(char) + rest)
+        else:
+            chars.append(re.escape(char))
+    if len(chars) == 1:
+        branches.append(chars[0])
+    elif chars:
+        branches.append("[%s]" % "".join(chars))
+    if not branches:
+        return ""
+    pattern = branches[0]
+    if len(branches) > 1 or "" in trie:
+        pattern = "(?:%s)" % "|".join(branches)
+    if "" in trie:
+        pattern += "?"
+    return pattern
+
+
+def compile_lexicon(words) -> Pattern:
+    """Compile words into one regex matching any of them as whole words.
+
+    Args:
+        words: Words to match.
+    Returns:
+        Pattern matching the longest of the words at any position, only
+        where it is not part of a larger word.
+    """
+    trie = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return re.compile(r"(?<!\w)%s(?!\w)" % _trie_pattern(trie))
+
+
+class Normalizer(object):
+    """Rewrites text the way it should be spoken, in a single pass."""
+
+    def __init__(self, lexicon: Dict[str, str]):
+        """ Initialize normalizer.
+
+        Args:
+            lexicon: Replacement of every word, matched case sensitively
+                and only as whole words.
+        """
+        super(Normalizer, self).__init__()
+        self.lexicon = dict(lexicon)
+        self.pattern = compile_lexicon(self.lexicon) if self.lexicon else None
+
+    def _replace(self, match) -> str:
+        return self.lexicon[match.group(0)]
+
+    def normalize(self, text: str) -> str:
+        """Replace every word of the lexicon in text.
+
+        Args:
+            text: Text to normalize.
+        Returns:
+            Normalized text.
+        """
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self._replace, text)
+
+
+def load_lexicon(filename: str) -> Dict[str, str]:
+    """Load a lexicon file, a JSON object of words and their replacements."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def lexicon_filenames(subreddit: str = None,
+                      filepath: str = LEXICON_PATH) -> List[str]:
+    """Get the lexicon files of a subreddit, whether they exist or not.
+
+    Args:
+        subreddit: Name of the subreddit, None for the default lexicon only.
+        filepath: Directory of the lexicons.
+    Returns:
+        Filenames of the default lexicon then the subreddit's, in the order
+        they are merged.
+    """
+    filenames = [os.path.join(filepath, "default.json")]
+    if subreddit is not None:
+        filenames.append(
+            os.path.join(filepath, "%s.json" % subreddit.lower())
+        )
+    return filenames
+
+
+@functools.lru_cache(maxsize=None)
+def get_normalizer(subreddit: str = None,
+                   filepath: str = LEXICON_PATH) -> Normalizer:
+    """Get the normalizer of a subreddit, built only once per process.
+
+    Args:
+        subreddit: Name of the subreddit, None for the default lexicon only.
+        filepath: Directory of the lexicons.
+    Returns:
+        Normalizer of the default lexicon merged with the subreddit's, the
+        subreddit's replacements win.
+    """
+    lexicon = {}
+    for filename in lexicon_filenames(subreddit, filepath):
+        lexicon.update(load_lexicon(filename))
+    return Normalizer(lexicon)
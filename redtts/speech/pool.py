@@ -0,0 +1,262 @@
+from typing import List, Tuple
+from .backends import make_backend, JOBS_PER_ENGINE
+import collections
+import multiprocessing
+import queue
+import time
+
+
+# Seconds a job may take before its engine is considered stuck.
+JOB_TIMEOUT = 60
+
+# Number of times a job's engine is restarted before the job fails.
+MAX_RESTARTS = 2
+
+# Jobs handed to an engine ahead of time, so it never waits for the next.
+_JOBS_PER_WORKER = 2
+
+# Seconds between checks on the engines while waiting for results.
+_POLL_INTERVAL = 1
+
+
+def _synthesis_worker(engine_id, jobs, results, backend, voice, rate_delta,
+                      jobs_per_engine):
+    """Synthesize jobs from the queue until told to stop.
+
+    The backend is kept alive between jobs and only reset after it fails,
+    or as it recycles its own engine. A failed job is retried once on a
+    fresh engine before the failure is reported.
+    Args:
+        engine_id: Id of the engine, sent along with every result.
+        jobs: Queue of (index, text, filename) jobs, None stops the worker.
+        results: Queue to report (engine_id, index, done, error) results to,
+            once as a job starts and once as it is done.
+        backend: Name of the text to speech backend.
+        voice: Name of supported voice.
+        rate_delta: Amount to add to the default voice rate.
+        jobs_per_engine: Number of jobs before the engine is recycled.
+    """
+    engine = None
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        index, text, filename = job
+        results.put((engine_id, index, False, None))
+        error = None
+        for _ in range(2):
+            try:
+                if engine is None:
+                    engine = make_backend(
+                        backend, voice, rate_delta, jobs_per_engine
+                    )
+                engine.synthesize(text, filename)
+                error = None
+                break
+            except Exception as e:
+                if engine is not None:
+                    engine.reset()
+                error = repr(e)
+        results.put((engine_id, index, True, error))
+    if engine is not None:
+        engine.close()
+
+
+class _Engine(object):
+    """Engine process of a synthesis pool and the jobs handed to it."""
+
+    def __init__(self, process, jobs):
+        super(_Engine, self).__init__()
+        self.process = process
+        self.jobs = jobs
+        # Ids of the jobs handed to the engine and not done yet, in order.
+        self.assigned = collections.deque()
+        # Id and start time of the job the engine is working on.
+        self.started = None
+
+
+class SynthesisPool(object):
+    """Pool of long lived text to speech engines in separate processes.
+
+    Engines that die or take longer than job_timeout on a job are killed
+    and replaced, and their jobs handed to other engines.
+    """
+
+    def __init__(self, num_workers: int, backend: str, voice: str,
+                 rate_delta=0, jobs_per_engine=JOBS_PER_ENGINE,
+                 job_timeout=JOB_TIMEOUT, max_restarts=MAX_RESTARTS):
+        """ Initialize synthesis pool.
+
+        Starts num_workers processes each owning one engine, sentences are
+        handed to every engine a couple at a time.
+        Args:
+            num_workers: Number of engine processes.
+            backend: Name of the text to speech backend.
+            voice: Name of supported voice.
+            rate_delta: Amount to add to the default voice rate.
+            jobs_per_engine: Number of jobs an engine completes before it is
+                recycled.
+            job_timeout: Seconds a job may take before its engine is killed.
+            max_restarts: Number of times a job's engine is killed and
+                replaced before the job fails.
+        """
+        super(SynthesisPool, self).__init__()
+        self.context = multiprocessing.get_context()
+        self.results = self.context.Queue()
+        self.args = (backend, voice, rate_delta, jobs_per_engine)
+        self.job_timeout = job_timeout
+        self.max_restarts = max_restarts
+
+        self.num_engines = 0
+        self.engines = {}
+        for _ in range(num_workers):
+            self._start_engine()
+
+        # Text and filename of submitted jobs, ids of the jobs not handed to
+        # an engine yet, restarts per job and errors of finished jobs that
+        # have not been waited on yet.
+        self.texts = {}
+        self.pending = collections.deque()
+        self.restarts = collections.Counter()
+        self.finished = {}
+        self.num_submitted = 0
+
+    def _start_engine(self):
+        """Start an engine process with its own job queue."""
+        engine_id = self.num_engines
+        self.num_engines += 1
+        jobs = self.context.Queue()
+        process = self.context.Process(
+            target=_synthesis_worker,
+            args=(engine_id, jobs, self.results) + self.args,
+            daemon=True
+        )
+        process.start()
+        self.engines[engine_id] = _Engine(process, jobs)
+
+    def _dispatch(self):
+        """Hand pending jobs to engines with room for them."""
+        for engine in self.engines.values():
+            while self.pending and len(engine.assigned) < _JOBS_PER_WORKER:
+                job_id = self.pending.popleft()
+                engine.assigned.append(job_id)
+                engine.jobs.put((job_id,) + self.texts[job_id])
+
+    def _restart_engine(self, engine_id: int, reason: str):
+        """Kill an engine, replace it and requeue its jobs.
+
+        The job it was working on fails once its engine has been restarted
+        max_restarts times.
+        """
+        engine = self.engines.pop(engine_id)
+        engine.process.terminate()
+        engine.process.join()
+        assigned = engine.assigned
+        if assigned:
+            job_id = assigned[0]
+            self.restarts[job_id] += 1
+            if self.restarts[job_id] > self.max_restarts:
+                assigned.popleft()
+                self.finished[job_id] = "engine %s %d times" % (
+                    reason, self.restarts[job_id]
+                )
+        self.pending.extendleft(reversed(assigned))
+        self._start_engine()
+
+    def _check_engines(self):
+        """Restart engines that died or are stuck on a job."""
+        now = time.monotonic()
+        for engine_id, engine in list(self.engines.items()):
+            if not engine.process.is_alive():
+                self._restart_engine(engine_id, "died")
+            elif (engine.started is not None
+                    and now - engine.started[1] > self.job_timeout):
+                self._restart_engine(engine_id, "timed out")
+
+    def _handle(self, engine_id: int, index: int, done: bool, error):
+        """Record a result of an engine."""
+        engine = self.engines.get(engine_id)
+        if engine is None:
+            # The engine was restarted, its jobs are handed out again.
+            return
+        if not done:
+            engine.started = (index, time.monotonic())
+            return
+        engine.started = None
+        engine.assigned.remove(index)
+        self.finished[index] = error
+
+    def submit(self, text: str, filename: str) -> int:
+        """Queue text to be synthesized without waiting for it.
+
+        Args:
+            text: Text to synthesize.
+            filename: Where to store the audio.
+        Returns:
+            Id of the job, to wait on.
+        """
+        job_id = self.num_submitted
+        self.num_submitted += 1
+        self.texts[job_id] = (text, filename)
+        self.pending.append(job_id)
+        self._dispatch()
+        return job_id
+
+    def wait(self, job_id: int):
+        """Block until a submitted job is done.
+
+        Args:
+            job_id: Id of the job, as returned by submit.
+        Raises:
+            RuntimeError: If the job failed, or its engine died or got stuck
+                more than max_restarts times.
+        """
+        while job_id not in self.finished:
+            try:
+                self._handle(*self.results.get(timeout=_POLL_INTERVAL))
+            except queue.Empty:
+                pass
+            self._check_engines()
+            self._dispatch()
+        error = self.finished.pop(job_id)
+        _, filename = self.texts.pop(job_id)
+        self.restarts.pop(job_id, None)
+        if error is not None:
+            raise RuntimeError(
+                "Speech synthesis failed for %s: %s" % (filename, error)
+            )
+
+    def synthesize(self, jobs: List[Tuple[str, str]]):
+        """Synthesize text to audio files, blocking until all are done.
+
+        Args:
+            jobs: List of text and filename to store the audio at pairs.
+        Raises:
+            RuntimeError: If any of the jobs failed.
+        """
+        job_ids = [self.submit(text, filename) for text, filename in jobs]
+        errors = []
+        for job_id in job_ids:
+            try:
+                self.wait(job_id)
+            except RuntimeError as e:
+                errors.append(str(e))
+        if errors:
+            raise RuntimeError("\n".join(errors))
+
+    def close(self):
+        """Stop all engine processes, killing those that do not stop."""
+        for engine in self.engines.values():
+            engine.jobs.put(None)
+        for engine in self.engines.values():
+            engine.process.join(self.job_timeout)
+            if engine.process.is_alive():
+                engine.process.terminate()
+                engine.process.join()
+        self.engines = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
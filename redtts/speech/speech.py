@@ -1,114 +1,226 @@
-from typing import Dict, List
+from typing import Iterable, Iterator, List
+from ..sentence import Sentence
 from . import intros
+from .backends import make_backend, JOBS_PER_ENGINE, VOICE_IDS
+from .cache import SpeechCache
+from .lexicon import get_normalizer, LEXICON_PATH
+from .pool import SynthesisPool
+import collections
 import os
 import praw
-import pyttsx3
 import random
-
-
-VOICE_IDS = {
-    'Alex': 'com.apple.speech.synthesis.voice.Alex',  # US
-    'Daniel': 'com.apple.speech.synthesis.voice.daniel',  # GB
-    'Fiona': 'com.apple.speech.synthesis.voice.fiona',  # Scotland
-    'Fred': 'com.apple.speech.synthesis.voice.Fred',  # US
-    'Karen': 'com.apple.speech.synthesis.voice.karen',  # AU
-    'Moira': 'com.apple.speech.synthesis.voice.moira',  # IE
-    'Samantha': 'com.apple.speech.synthesis.voice.samantha',  # US
-    'Tessa': 'com.apple.speech.synthesis.voice.tessa',  # ZA
-    'Veena': 'com.apple.speech.synthesis.voice.veena',  # IN
-    'Victoria': 'com.apple.speech.synthesis.voice.Victoria'  # US
-}
+import shutil
 
 
 class VoiceBot(object):
     """Voice bot generates synthesized speech."""
 
-    def __init__(self, rate_delta=0, voice="Daniel"):
+    def __init__(self, rate_delta=0, voice="Daniel", workers=0,
+                 jobs_per_engine=JOBS_PER_ENGINE, cache: SpeechCache = None,
+                 backend="pyttsx3", lexicon_path=LEXICON_PATH):
         """ Initialize voice bot.
 
         VoiceBot to speak lines and generate text to speech data.
         Args:
             rate_delta: Amount to add to the default voice rate.
             voice: Name of supported voice.
+            workers: Number of engine processes to synthesize speech files
+                with, zero synthesizes in this process.
+            jobs_per_engine: Number of sentences an engine synthesizes
+                before it is recycled.
+            cache: Cache to serve previously synthesized sentences from.
+            backend: Name of the text to speech backend, pyttsx3 drives the
+                platform voices and espeak-ng the local engine.
+            lexicon_path: Directory of the lexicons text is normalized with
+                before it is spoken.
         """
         super(VoiceBot, self).__init__()
 
-        # Initialize text to speech engine.
-        self.engine = pyttsx3.init()
-
-        # Set voice.
+        # Set voice and speaking speed.
         assert voice in VOICE_IDS.keys()
         self.voice = voice
-        self.engine.setProperty('voice', VOICE_IDS[voice])
-
-        # Adjust speaking speed.
         self.rate = rate_delta
-        self.engine.setProperty(
-            'rate', self.engine.getProperty('rate') + self.rate
+
+        # Initialize text to speech backend, engines start on first use.
+        self.backend_name = backend
+        self.backend = make_backend(
+            backend, voice=voice, rate_delta=rate_delta,
+            jobs_per_engine=jobs_per_engine
         )
+        self.jobs_per_engine = jobs_per_engine
+        self.lexicon_path = lexicon_path
 
-    def _preprocess(self, text):
-        """Preprocess text, handle acronyms and censorship."""
-        words = {
-            "WIBTA": "would I be the A hole",
-            "AmItheAsshole": "am I the A hole",
-            "AITA": "am I the A hole", "aita": "am I the A hole",
-            "Aita": "am I the A hole",
-            "Asshole": "A hole", "ASSHOLE": "A hole", "asshole": "A hole",
-            "JPOW": "J pow", "jpow": "J pow",
-            "coronavirus": "corona virus",
-            "hentai": "hen tie", "Hentai": "hen tie",
-        }
-        for k, v in words.items():
-            text = text.replace(k, v)
-        return text
-
-    def generate_speech_files(self, text_list: List[str],
+        # Synthesis pool is started on first use.
+        self.workers = workers
+        self.pool = None
+        self.cache = cache
+
+    def _preprocess(self, text, subreddit=None):
+        """Preprocess text, handle acronyms and censorship.
+
+        Args:
+            text: Text to be spoken.
+            subreddit: Name of the subreddit the text is from, its lexicon
+                applies on top of the default one.
+        Returns:
+            Text as it should be handed to the engine.
+        """
+        return get_normalizer(subreddit, self.lexicon_path).normalize(text)
+
+    def _prepare(self, i: int, sentence: Sentence, filepath: str,
+                 submission, include_intro=False):
+        """Set the audio filename of a sentence and work out what to speak.
+
+        Args:
+            i: Position of the sentence in the sentences being generated.
+            sentence: Sentence to be translated.
+            filepath: Where to store the audio files.
+            submission: Reddit submission.
+            include_intro: Whether this should include intro voice.
+        Returns:
+            Text and filename to synthesize, None if served from the cache.
+        """
+        filename = filepath + "/recording_%s.%s" % (
+            str(sentence.index), self.backend.extension
+        )
+        text = sentence.text
+
+        subreddit, seed = None, None
+        if submission is not None:
+            subreddit = submission.subreddit.display_name
+            seed = submission.id
+        if i == 0 and include_intro:
+            # Pick the intro by submission, so it is spoken from the cache
+            # when the submission is made again.
+            intro = (
+                random.Random(seed).choice(intros.intros) +
+                " Welcome to R slash %s..., , , "
+                % subreddit
+            )
+            text = intro + text
+
+        # Serve the sentence from the cache if it was spoken before.
+        spoken_text = self._preprocess(text, subreddit)
+        cached_filename = None
+        if self.cache is not None:
+            cached_filename = self.cache.get(self.cache.key(
+                spoken_text, self.backend.voice_id, self.rate
+            ))
+        print(text, filename)
+        sentence.audio = filename
+        if cached_filename is not None:
+            try:
+                shutil.copyfile(cached_filename, filename)
+                return None
+            except FileNotFoundError:
+                # Evicted since it was looked up, synthesize it instead.
+                pass
+        return spoken_text, filename
+
+    def _get_pool(self) -> SynthesisPool:
+        """Get the synthesis pool, starting it on first use."""
+        if self.pool is None:
+            self.pool = SynthesisPool(
+                num_workers=self.workers, backend=self.backend_name,
+                voice=self.voice, rate_delta=self.rate,
+                jobs_per_engine=self.jobs_per_engine
+            )
+        return self.pool
+
+    def _synthesize(self, text: str, filename: str):
+        """Synthesize text with the in process engine."""
+        self.backend.synthesize(text, filename)
+
+    def _cache_put(self, text: str, filename: str):
+        """Store a synthesized sentence in the cache, if any."""
+        if self.cache is not None:
+            self.cache.put(
+                self.cache.key(text, self.backend.voice_id, self.rate),
+                filename
+            )
+
+    def generate_speech_files(self, sentences: List[Sentence],
                               filepath: str,
                               submission,
-                              include_intro=False) -> Dict[str, str]:
+                              include_intro=False) -> List[Sentence]:
         """Generate voice speech files.
 
-        Generate mp3 of text to speech for each given sentence.
-        Map given sentences to filenames that point to where mp3's of the
-        generated voices are stored.
+        Generate audio of text to speech for each given sentence.
+        Set the audio of every sentence to the filename of where the audio
+        of its generated voice is stored. Sentences found in the cache are
+        copied from it instead of synthesized, so evicting the cache can not
+        remove a file that is still in use.
         Args:
-            text_list: List of phrases to be translated.
-            filepath: Where to store the mp3 files.
+            sentences: Sentences to be translated.
+            filepath: Where to store the audio files.
             submission: Reddit submission.
             include_intro: Whether this should include intro voice.
         Returns:
-            Dictionary mapping sentence of filename.
+            The given sentences, with their audio set.
+        """
+        if not os.path.exists(filepath):
+            os.makedirs(filepath)
+        jobs = [
+            self._prepare(i, sentence, filepath, submission, include_intro)
+            for i, sentence in enumerate(sentences)
+        ]
+        jobs = [job for job in jobs if job is not None]
+
+        # Generate text to speech, in process the backend synthesizes every
+        # sentence in one batch.
+        if self.workers > 0:
+            self._get_pool().synthesize(jobs)
+        else:
+            self.backend.synthesize_batch(jobs)
+
+        for text, filename in jobs:
+            self._cache_put(text, filename)
+        return sentences
+
+    def iter_speech_files(self, sentences: Iterable[Sentence], filepath: str,
+                          submission,
+                          include_intro=False) -> Iterator[Sentence]:
+        """Generate voice speech files as sentences arrive.
+
+        Streaming version of generate_speech_files, sentences are consumed
+        lazily and yielded in order as soon as their audio is ready. With
+        engine processes, up to two sentences per process are synthesized
+        ahead of the one being waited on.
+        Args:
+            sentences: Sentences to be translated, may be a generator.
+            filepath: Where to store the audio files.
+            submission: Reddit submission.
+            include_intro: Whether this should include intro voice.
+        Yields:
+            The given sentences, with their audio set.
         """
-        speech_map = {}
         if not os.path.exists(filepath):
             os.makedirs(filepath)
-        for i, text in enumerate(text_list):
-            # Generate text to speech.
-            filename = filepath + "/recording_%s.mp3" % str(i)
-            audio_key = text
-
-            if i == 0 and include_intro:
-                subreddit = submission.subreddit.display_name
-                intro = (
-                    random.choice(intros.intros) +
-                    " Welcome to R slash %s..., , , "
-                    % subreddit
-                )
-                text = intro + text
-
-            self.engine.save_to_file(
-                self._preprocess(text), filename
+        pending = collections.deque()
+        for i, sentence in enumerate(sentences):
+            job = self._prepare(
+                i, sentence, filepath, submission, include_intro
             )
-            self.engine.runAndWait()
-
-            # Prevent the engine from getting caught.
-            self._refresh_engine()
-
-            # Map file name to text.
-            print(text, filename)
-            speech_map[audio_key + str(i)] = filename
-        return speech_map
+            if job is not None and self.workers == 0:
+                self._synthesize(*job)
+                self._cache_put(*job)
+                job = None
+            job_id = None
+            if job is not None:
+                job_id = self._get_pool().submit(*job)
+            pending.append((sentence, job, job_id))
+            while pending and (len(pending) > 2 * self.workers
+                               or pending[0][1] is None):
+                yield self._finish(*pending.popleft())
+        while pending:
+            yield self._finish(*pending.popleft())
+
+    def _finish(self, sentence: Sentence, job, job_id) -> Sentence:
+        """Wait for the audio of a streamed sentence."""
+        if job is not None:
+            self.pool.wait(job_id)
+            self._cache_put(*job)
+        return sentence
 
     def speak(self, text: str):
         """Speak given text.
@@ -118,14 +230,11 @@ class VoiceBot(object):
         Args:
             text: Text to be translated to audio.
         """
-        self.engine.say(text)
-        self.engine.runAndWait()
-
-    def _refresh_engine(self):
-        """Text to speech engine needs to be remade.
-
-        Text to speech engine needs to be re-instantiated after every call of
-        engine.runAndWait() to avoid getting caught.
-        """
-        del self.engine
-        self.__init__(self.rate, self.voice)
+        self.backend.speak(text)
+
+    def close(self):
+        """Stop the synthesis pool, if one was started, and the engine."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        self.backend.close()
@@ -1,4 +1,7 @@
-from typing import List
+from typing import Iterator, List, Tuple
+import functools
+import hashlib
+import json
 import os
 import re
 
@@ -8,42 +11,77 @@ def get_asset_filepath():
     return os.path.join(os.path.dirname(__file__), 'assets')
 
 
+def hash_inputs(*inputs) -> str:
+    """Hash the inputs of a build step into a cache key.
+
+    Args:
+        inputs: JSON serializable values, anything else is hashed by its
+            string representation.
+    Returns:
+        Hex digest of the inputs.
+    """
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(filename: str) -> List:
+    """Identify the version of a file without reading it.
+
+    Args:
+        filename: File to fingerprint, such as a font.
+    Returns:
+        Absolute path, size and modification time of the file, or just the
+        filename if it is not a path on disk (e.g. a system font name).
+    """
+    if not os.path.exists(filename):
+        return [filename]
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime]
+
+
+# Lines that are just a link are dropped before splitting.
+_URL_LINE = re.compile(r'^https?:\/\/.*[\r\n]*', flags=re.MULTILINE)
+
+# Sentences end at whitespace after a period, question mark, comma or
+# semicolon, unless it follows an abbreviation such as "e.g." or "Mr.", or
+# at whitespace after a closing quote ending in a period or question mark.
+_SENTENCE_BREAK = re.compile(
+    r'(?:(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=[.?,;])|(?<=\.\"|\?\"))\s'
+)
+
+
+def iter_sentences(text: str) -> Iterator[str]:
+    """Split paragraph into sentences lazily.
+
+    Makes a single pass over the text, yielding each sentence as soon as
+    its end is found.
+    Args:
+        text: Text to be parsed into sentences.
+    Yields:
+        Sentences, the same as tokenize returns.
+    """
+    text = _URL_LINE.sub('', text)
+    start = 0
+    for match in _SENTENCE_BREAK.finditer(text):
+        yield text[start:match.start()]
+        start = match.end()
+    yield text[start:]
+
+
+@functools.lru_cache(maxsize=256)
+def _tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(iter_sentences(text))
+
+
 def tokenize(text: str) -> List[str]:
     """Tokenize paragraph into sentences.
 
     Create a list of strings, each element of the list representing a sentence,
-    based on the below regex rule.
+    based on the rules of iter_sentences. Results are cached, so tokenizing
+    the same text again in a process is free.
     Args:
         text: Text to be parsed into sentences.
     Returns:
         List of sentences.
     """
-    no_url_text = re.sub(r'^https?:\/\/.*[\r\n]*', '',
-                         text, flags=re.MULTILINE)
-
-    # Split based on periods.
-    parse_1 = re.split(
-        "(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s", no_url_text
-    )
-    # Split based on commas.
-    parse_2 = []
-    for phrase in parse_1:
-        parse_2.extend(
-            re.split(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\,|\;)\s", phrase)
-        )
-    # Split based on semicolons.
-    parse_3 = []
-    for phrase in parse_2:
-        parse_3.extend(
-            re.split(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\,|\;)\s", phrase)
-        )
-    # Split based on periods + quotes and whitespace or question marks +
-    # quotations and whitespace
-    parse_4 = []
-    for phrase in parse_3:
-        parse_4.extend(
-            re.split(r"(?<=\.\"|\?\")\s", phrase)
-        )
-
-    return parse_4
-
+    return list(_tokenize(text))
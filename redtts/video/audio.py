@@ -0,0 +1,129 @@
+from pydub import AudioSegment
+from typing import Iterator, List, Tuple
+import wave
+
+
+# Gain in dB applied to background music while speech is playing.
+DUCK_DELTA = -12
+
+
+class AudioAssembler(object):
+    """Assemble clips into a single lossless WAV file as they arrive."""
+
+    def __init__(self, filename: str):
+        """ Initialize audio assembler.
+
+        Clips are appended as raw PCM, nothing is re-encoded and only the
+        clip being appended is held in memory. The first clip decides the
+        sample rate, channels and sample width of the file, later clips are
+        converted to match.
+        Args:
+            filename: Where to write the WAV file.
+        """
+        super(AudioAssembler, self).__init__()
+        self.filename = filename
+        self.wav = None
+        self.frame_rate, self.channels, self.sample_width = None, None, None
+        self.num_samples = 0
+
+    def _open(self, audio: AudioSegment):
+        self.frame_rate = audio.frame_rate
+        self.channels = audio.channels
+        self.sample_width = audio.sample_width
+        self.wav = wave.open(self.filename, "wb")
+        self.wav.setnchannels(self.channels)
+        self.wav.setsampwidth(self.sample_width)
+        self.wav.setframerate(self.frame_rate)
+
+    def append(self, audio: AudioSegment):
+        """Append a clip.
+
+        Args:
+            audio: Decoded clip to append.
+        """
+        if self.wav is None:
+            self._open(audio)
+        audio = audio.set_frame_rate(self.frame_rate)
+        audio = audio.set_channels(self.channels)
+        audio = audio.set_sample_width(self.sample_width)
+        self.wav.writeframes(audio.raw_data)
+        self.num_samples += int(audio.frame_count())
+
+    def append_silence(self, num_samples: int):
+        """Append silence.
+
+        Args:
+            num_samples: Length of the silence in samples, at the sample
+                rate of the file.
+        """
+        if num_samples <= 0:
+            return
+        if self.wav is None:
+            self._open(AudioSegment.silent(duration=0))
+        # 8 bit WAV samples are unsigned, silence sits at the midpoint.
+        silence = b"\x80" if self.sample_width == 1 else b"\x00"
+        self.wav.writeframes(
+            silence * (num_samples * self.channels * self.sample_width)
+        )
+        self.num_samples += num_samples
+
+    def samples_for(self, seconds: float) -> int:
+        """Convert a duration to a number of samples of the file."""
+        return int(round(seconds * self.frame_rate))
+
+    @property
+    def duration(self) -> float:
+        """Duration of the assembled audio in seconds."""
+        if self.frame_rate is None:
+            return 0.0
+        return self.num_samples / float(self.frame_rate)
+
+    def close(self):
+        """Finish writing the WAV file."""
+        if self.wav is None:
+            self._open(AudioSegment.silent(duration=0))
+        self.wav.close()
+
+
+def background_bed(music: AudioSegment, duration: float, volume_delta=0,
+                   speech_spans: List[Tuple[float, float]] = (),
+                   duck_delta=DUCK_DELTA) -> Iterator[AudioSegment]:
+    """Loop background music to an exact duration, one chunk at a time.
+
+    Every chunk is at most one pass over the music, so the looped bed is
+    never held in memory as a whole.
+    Args:
+        music: Decoded background music.
+        duration: Duration of the bed in seconds.
+        volume_delta: Gain in dB applied to the music.
+        speech_spans: Sorted start and end times in seconds of speech, the
+            music is lowered while speech is playing.
+        duck_delta: Additional gain in dB applied to the music under speech.
+    Yields:
+        Consecutive chunks of the bed.
+    """
+    music = music + volume_delta
+    duration_ms = int(round(duration * 1000))
+    spans = [
+        (int(start * 1000), int(end * 1000)) for start, end in speech_spans
+    ]
+    span_index = 0
+    position = 0
+    while position < duration_ms and len(music) > 0:
+        chunk = music[:duration_ms - position]
+        end = position + len(chunk)
+
+        # Duck the parts of the chunk that overlap with speech.
+        while span_index < len(spans) and spans[span_index][1] <= position:
+            span_index += 1
+        for start, stop in spans[span_index:]:
+            if start >= end:
+                break
+            start, stop = max(start, position), min(stop, end)
+            chunk = (
+                chunk[:start - position] +
+                chunk[start - position:stop - position].apply_gain(duck_delta)
+                + chunk[stop - position:]
+            )
+        yield chunk
+        position = end
@@ -0,0 +1,136 @@
+from typing import List, Tuple
+import os
+import subprocess
+
+
+# Binary used to invoke ffmpeg, overridable for non standard installs.
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+AUDIO_CODEC = "aac"
+AUDIO_BITRATE = "192k"
+# Lossless codec for intermediate videos, so audio is only encoded lossy once.
+LOSSLESS_AUDIO_CODEC = "alac"
+
+
+def run(args: List[str]):
+    """Run ffmpeg with the given arguments.
+
+    Args:
+        args: Command line arguments passed to ffmpeg.
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg exits with an error.
+    """
+    subprocess.run(
+        [FFMPEG_BINARY, "-y", "-loglevel", "error"] + args, check=True
+    )
+
+
+def _quote(filename: str) -> str:
+    """Quote a filename for a concat demuxer file list."""
+    return "'%s'" % os.path.abspath(filename).replace("'", "'\\''")
+
+
+def mux(video_filename: str, audio_filename: str, output_filename: str):
+    """Mux an audio track onto a video.
+
+    The video stream is copied as is and the audio is encoded losslessly,
+    muxed videos are processed further before the final encode.
+    Args:
+        video_filename: Video to take the video stream from.
+        audio_filename: Audio to use as the audio stream.
+        output_filename: Where to store the muxed video.
+    """
+    run([
+        "-i", video_filename, "-i", audio_filename,
+        "-map", "0:v", "-map", "1:a", "-c:v", "copy",
+        "-c:a", LOSSLESS_AUDIO_CODEC, output_filename
+    ])
+
+
+def encode_stills(stills: List[Tuple[str, float]], output_filename: str,
+                  list_filename: str):
+    """Encode a timeline of still images into a video.
+
+    Each image is fed to the encoder once along with how long it is shown,
+    so encoding work scales with the number of images rather than the
+    duration of the video.
+    Args:
+        stills: List of image filename and duration in seconds pairs.
+        output_filename: Where to store the video.
+        list_filename: Where to store the concat demuxer file list.
+    """
+    with open(list_filename, "w") as f:
+        # Durations are rounded at their cumulative end times, so rounding
+        # errors do not add up over the timeline and drift from the audio.
+        start = end = 0.0
+        for image_filename, duration in stills:
+            end += duration
+            f.write("file %s\nduration %.3f\n" % (
+                _quote(image_filename), round(end, 3) - round(start, 3)
+            ))
+            start = end
+        # The concat demuxer ignores the duration of the last entry unless
+        # the entry is repeated.
+        if stills:
+            f.write("file %s\n" % _quote(stills[-1][0]))
+    run([
+        "-f", "concat", "-safe", "0", "-i", list_filename,
+        "-vsync", "vfr", "-c:v", "libx264", "-tune", "stillimage",
+        "-pix_fmt", "yuv420p", output_filename
+    ])
+
+
+def concat(video_filenames: List[str], output_filename: str,
+           list_filename: str):
+    """Concatenate videos without re-encoding them.
+
+    Uses the concat demuxer to stream copy every video, all videos must share
+    the same codecs and dimensions.
+    Args:
+        video_filenames: Videos to concatenate, in order.
+        output_filename: Where to store the concatenated video.
+        list_filename: Where to store the concat demuxer file list.
+    """
+    with open(list_filename, "w") as f:
+        for video_filename in video_filenames:
+            f.write("file %s\n" % _quote(video_filename))
+    run([
+        "-f", "concat", "-safe", "0", "-i", list_filename,
+        "-c", "copy", output_filename
+    ])
+
+
+def mix_background(video_filename: str, music_filename: str,
+                   output_filename: str, volume_delta=0, duck=False):
+    """Mix looped background music under the audio of a video.
+
+    The music is looped and trimmed to the video inside the filter graph, so
+    the video stream is copied and the audio is encoded a single time.
+    Args:
+        video_filename: Video with the speech audio.
+        music_filename: Background music to loop under the video.
+        output_filename: Where to store the video with background music.
+        volume_delta: Gain in dB applied to the background music.
+        duck: Whether to lower the background music while speech is playing.
+    """
+    music_filter = "[1:a]volume=%sdB[music]" % volume_delta
+    if duck:
+        filter_graph = (
+            "[0:a]asplit=2[speech][sidechain];" + music_filter + ";"
+            "[music][sidechain]sidechaincompress="
+            "threshold=0.02:ratio=6:attack=20:release=400[bed];"
+        )
+    else:
+        filter_graph = (
+            "[0:a]anull[speech];" + music_filter + ";[music]anull[bed];"
+        )
+    filter_graph += (
+        "[speech][bed]amix=inputs=2:duration=first:"
+        "dropout_transition=0:normalize=0[audio]"
+    )
+    run([
+        "-i", video_filename, "-stream_loop", "-1", "-i", music_filename,
+        "-filter_complex", filter_graph,
+        "-map", "0:v", "-map", "[audio]",
+        "-c:v", "copy", "-c:a", AUDIO_CODEC, "-b:a", AUDIO_BITRATE,
+        output_filename
+    ])
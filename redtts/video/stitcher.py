@@ -1,16 +1,26 @@
 from pydub import AudioSegment
+from typing import Iterable
 from .. import utils
+from ..sentence import Sentence
+from .audio import AudioAssembler, background_bed
 from . import constants
+from . import ffmpeg
 import cv2
 import math
 import moviepy.editor as mpe
+import numpy as np
 import os
 
 
+# Supported muxing backends.
+BACKENDS = ["moviepy", "ffmpeg"]
+
+
 class Stitcher(object):
     """Stitch audio and image together to make video."""
 
-    def __init__(self, filepath, fps, width, height):
+    def __init__(self, filepath, fps, width, height, backend="moviepy",
+                 still_frames=False):
         """ Initialize video stitcher.
 
         VoiceBot to speak lines and generate text to speech data.
@@ -19,64 +29,187 @@ class Stitcher(object):
             fps: FPS of video.
             width: Width of each video frame in pixels.
             height: Height of each video frame in pixels.
+            backend: Muxing backend, moviepy re-encodes the video at every
+                step while ffmpeg encodes the video once and stream copies
+                it afterwards.
+            still_frames: Whether to encode each image once with its
+                duration instead of duplicating frames at a fixed fps,
+                requires the ffmpeg backend.
         """
         self.filepath = filepath
         if not os.path.exists(filepath):
             os.makedirs(filepath)
 
+        assert backend in BACKENDS
+        assert backend == "ffmpeg" or not still_frames
+        self.backend, self.still_frames = backend, still_frames
         self.fps, self.width, self.height = fps, width, height
         self.videos = []
+        # Duration in seconds and speech spans of every video, None if
+        # unknown.
+        self.durations = []
+        self.speech_spans = []
         self.composite_video_filename = None
 
-    def stitch(self, text_list, image_map, audio_map):
-        """Stitch together image and audio files into a video."""
+    def _load_frame(self, image):
+        """Decode an image into a BGR frame the video writer accepts.
+
+        Args:
+            image: Filename of an image, PIL image or BGR numpy array.
+        Returns:
+            BGR numpy array.
+        """
+        if isinstance(image, str):
+            return cv2.imread(image)
+        if isinstance(image, np.ndarray):
+            return image
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+    def _still_frame(self, image, filename):
+        """Get an image file the ffmpeg concat demuxer can read.
+
+        Args:
+            image: Filename of an image, PIL image or BGR numpy array.
+            filename: Where to write the image if it is not on disk yet.
+        Returns:
+            Filename of the image.
+        """
+        if isinstance(image, str):
+            return image
+        # Favour speed over size, the file only lives until the encode.
+        cv2.imwrite(
+            filename, self._load_frame(image),
+            [cv2.IMWRITE_PNG_COMPRESSION, 1]
+        )
+        return filename
+
+    def stitch(self, sentences: Iterable[Sentence]):
+        """Stitch together image and audio files into a video.
+
+        Sentences are consumed one at a time, so they can be streamed in
+        while earlier stages are still producing them.
+        Args:
+            sentences: Sentences in the order they are spoken, with their
+                image and audio set. Their duration is set as they are
+                stitched.
+        """
         current_filepath = self.filepath + "/video_%s" % str(len(self.videos))
         if not os.path.exists(current_filepath):
             os.makedirs(current_filepath)
         video_filename = current_filepath + "/video.mp4"
-        video = cv2.VideoWriter(
-            filename=video_filename, fourcc=cv2.VideoWriter_fourcc(*'mp4v'),
-            fps=self.fps, frameSize=(self.width, self.height)
-        )
-        # Render video frames.
-        for i, text_key in enumerate(text_list):
-            image_filename = image_map[text_key + str(i)]
-            audio_filename = audio_map[text_key + str(i)]
-            audio = AudioSegment.from_file(audio_filename)
+        if not self.still_frames:
+            video = cv2.VideoWriter(
+                filename=video_filename,
+                fourcc=cv2.VideoWriter_fourcc(*'mp4v'),
+                fps=self.fps, frameSize=(self.width, self.height)
+            )
+        # Render video frames, decoding each frame only once, and stream the
+        # audio of every sentence into one WAV file as it is read.
+        combined_audio_filename = current_filepath + "/audio.wav"
+        assembler = AudioAssembler(combined_audio_filename)
+        total_frames = 0
+        speech_spans = []
+        stills = []
+        image, frame = None, None
+        for sentence in sentences:
+            # Frames only repeat back to back, keep just the last decoded
+            # frame rather than every frame of the segment. The last image
+            # is held on to so it can be compared by identity.
+            if frame is None or not (
+                    sentence.image is image or (
+                        isinstance(image, str) and sentence.image == image)):
+                image = sentence.image
+                if self.still_frames:
+                    frame = self._still_frame(
+                        image, current_filepath + "/frame_%s.png" % len(stills)
+                    )
+                else:
+                    frame = self._load_frame(image)
+            audio = AudioSegment.from_file(sentence.audio)
+            start = assembler.duration
+            assembler.append(audio)
+            sentence.duration = assembler.duration - start
+            speech_spans.append((start, assembler.duration))
+
+            # Show the image for exactly as long as the audio, no padding.
+            if self.still_frames:
+                stills.append((frame, sentence.duration))
+                continue
 
             # Calculate the number of frames to add for this section of audio.
             num_frames = int(math.ceil(
                 (len(audio) / 1000.0) / (1.0 / self.fps)))
             for _ in range(num_frames):
-                video.write(cv2.imread(image_filename))
-
-            # Pad the audio file to account for the fps.
-            desired_duration = int((num_frames/float(self.fps)) * 1000)
-            padded_duration = desired_duration - len(audio)
-            padded_audio = AudioSegment.silent(duration=padded_duration)
-            audio = audio + padded_audio
-            audio.export(audio_filename)
-
-        video.release()
-        cv2.destroyAllWindows()
-
-        # Compile audio.
-        combined_audio = AudioSegment.empty()
-        for i, text_key in enumerate(text_list):
-            combined_audio += AudioSegment.from_file(
-                audio_map[text_key + str(i)]
+                video.write(frame)
+
+            # Pad the audio with silence to account for the fps, measured
+            # from the start so rounding does not drift the audio.
+            total_frames += num_frames
+            assembler.append_silence(
+                assembler.samples_for(total_frames / float(self.fps))
+                - assembler.num_samples
             )
-        combined_audio_filename = current_filepath + "/audio.mp3"
-        combined_audio.export(combined_audio_filename)
+        assembler.close()
+
+        if self.still_frames:
+            ffmpeg.encode_stills(
+                stills, video_filename,
+                list_filename=current_filepath + "/frames.txt"
+            )
+        else:
+            video.release()
 
         # Overlay audio onto video.
-        video_clip = mpe.VideoFileClip(video_filename)
-        audio_clip = mpe.AudioFileClip(combined_audio_filename)
-        new_audioclip = mpe.CompositeAudioClip([audio_clip])
-        video_clip.audio = new_audioclip
         final_video_file_name = current_filepath + "/video_audio.mp4"
-        video_clip.write_videofile(final_video_file_name)
-        self.videos.append(final_video_file_name)
+        if self.backend == "ffmpeg":
+            # Segments are concatenated and mixed with music later on, keep
+            # their audio lossless until the final encode.
+            ffmpeg.mux(
+                video_filename, combined_audio_filename,
+                final_video_file_name
+            )
+        else:
+            video_clip = mpe.VideoFileClip(video_filename)
+            audio_clip = mpe.AudioFileClip(combined_audio_filename)
+            new_audioclip = mpe.CompositeAudioClip([audio_clip])
+            video_clip.audio = new_audioclip
+            video_clip.write_videofile(final_video_file_name)
+        self.add_video(
+            final_video_file_name, assembler.duration, speech_spans
+        )
+
+    def add_video(self, video_filename, duration=None, speech_spans=None):
+        """Add an already stitched video, such as one made by another process.
+
+        Args:
+            video_filename: Filename of the video to compile with the rest.
+            duration: Duration of the video in seconds, if known.
+            speech_spans: Start and end times in seconds of speech in the
+                video, if known.
+        """
+        self.videos.append(video_filename)
+        self.durations.append(duration)
+        self.speech_spans.append(speech_spans)
+
+    def _composite_speech_spans(self):
+        """Get the speech spans of the composite video.
+
+        Returns:
+            Start and end times in seconds of speech, up to the first video
+            whose timing is unknown.
+        """
+        spans = []
+        offset = 0.0
+        for duration, speech_spans in zip(self.durations, self.speech_spans):
+            if duration is None or speech_spans is None:
+                break
+            spans.extend(
+                (offset + start, offset + end) for start, end in speech_spans
+            )
+            offset += duration
+        return spans
 
     def stitch_outro(self, voice_bot):
         """Create outro."""
@@ -84,62 +217,80 @@ class Stitcher(object):
                 utils.get_asset_filepath() +
                 "/outro_background.png"
         )
-        audio_map = voice_bot.generate_speech_files(
-            text_list=[constants.OUTRO],
+        sentences = voice_bot.generate_speech_files(
+            sentences=[Sentence(
+                0, constants.OUTRO, image=outro_background_filename
+            )],
             filepath=self.filepath + "/outro_audio",
             submission=None,
             include_intro=False
         )
-        text_key = constants.OUTRO + "0"
-        image_map = {text_key: outro_background_filename}
-        self.stitch(
-            [constants.OUTRO], image_map, audio_map
-        )
+        self.stitch(sentences)
 
     def compile_all_videos(self, include_outro=False, voice_bot=None):
         """Compile all videos into one video."""
         if include_outro:
             self.stitch_outro(voice_bot)
+        self.composite_video_filename = self.filepath + "/composite_video.mp4"
+
+        # Every segment shares the same codecs, stream copy them.
+        if self.backend == "ffmpeg":
+            ffmpeg.concat(
+                self.videos, self.composite_video_filename,
+                list_filename=self.filepath + "/videos.txt"
+            )
+            return
+
         clips = [
             mpe.VideoFileClip(video_filename) for video_filename
             in self.videos
         ]
 
         concat_clip = mpe.concatenate_videoclips(clips)
-        self.composite_video_filename = self.filepath + "/composite_video.mp4"
         concat_clip.write_videofile(self.composite_video_filename)
 
-    def add_background_music(self, volume_delta=0):
-        """Overlay background music onto the video."""
+    def add_background_music(self, volume_delta=0, duck=False):
+        """Overlay background music onto the video.
+
+        Args:
+            volume_delta: Gain in dB applied to the background music.
+            duck: Whether to lower the music under speech.
+        """
         if self.composite_video_filename is None:
             print("Please compile all videos.")
 
-        # Get the video duration in milliseconds.
-        video_clip = mpe.VideoFileClip(self.composite_video_filename)
-        video_duration = int(video_clip.duration * 1000)
-
-        # Load background music, extend it to be the duration of video.
         background_audio_filename = (
             utils.get_asset_filepath() +
             "/background_music/bensound-allthat.mp3"
         )
-        background_audio = AudioSegment.from_file(background_audio_filename)
-        background_audio = background_audio + volume_delta
-        while len(background_audio) < video_duration:
-            background_audio += background_audio
-        background_audio = background_audio[:video_duration]
+        final_video_file_name = self.filepath + "/composite_video_bg.mp4"
+        if self.backend == "ffmpeg":
+            ffmpeg.mix_background(
+                self.composite_video_filename, background_audio_filename,
+                final_video_file_name, volume_delta=volume_delta, duck=duck
+            )
+            return
+
+        # Loop the music to exactly the duration of the video, streaming it
+        # to disk one pass of the music at a time. Opening the clip only
+        # reads its header, the video is decoded once while writing.
+        video_clip = mpe.VideoFileClip(self.composite_video_filename)
+        speech_spans = self._composite_speech_spans() if duck else ()
         video_background_audio_filename = (
-                self.filepath + "/background_audio.mp3"
+                self.filepath + "/background_audio.wav"
         )
-        background_audio.export(video_background_audio_filename)
+        assembler = AudioAssembler(video_background_audio_filename)
+        for chunk in background_bed(
+                AudioSegment.from_file(background_audio_filename),
+                video_clip.duration, volume_delta=volume_delta,
+                speech_spans=speech_spans):
+            assembler.append(chunk)
+        assembler.close()
 
         # Add to video.
-        audio_clip = mpe.AudioFileClip(
-            video_background_audio_filename
-        ).set_duration(video_clip.duration)
+        audio_clip = mpe.AudioFileClip(video_background_audio_filename)
         new_audio = mpe.CompositeAudioClip([video_clip.audio, audio_clip])
         video_clip.audio = new_audio
 
         # Write out video with background audio.
-        final_video_file_name = self.filepath + "/composite_video_bg.mp4"
         video_clip.write_videofile(final_video_file_name)
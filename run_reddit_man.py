@@ -1,77 +1,603 @@
+from concurrent.futures import ProcessPoolExecutor
 import argparse
+import functools
+import glob
 import json
+import os
+import shutil
+import traceback
+import redtts.cache as cache
 import redtts.reddit.reddit as r
+import redtts.reddit.reddit_utils as ru
+import redtts.reddit.store as store
 import redtts.utils as utils
+import redtts.speech.backends as backends
+import redtts.speech.cache as speech_cache
+import redtts.speech.lexicon as lexicon
 import redtts.speech.speech as speech
 import redtts.image.image as im
+import redtts.instrument as instrument
+import redtts.pipeline as pipeline
 import redtts.video.stitcher as stitch
 
 
 parser = argparse.ArgumentParser(description='Make videos.')
 parser.add_argument('--config', default='',
                     help='Location of config.')
-args = parser.parse_args()
+parser.add_argument('--configs', nargs='+', default=[],
+                    help='Configs, or glob patterns of configs, to make an '
+                         'episode of each in one batch. Completed episodes '
+                         'are skipped.')
+parser.add_argument('--output', default='_tmp',
+                    help='Working directory, every episode of a batch gets '
+                         'its own directory in it.')
+parser.add_argument('--save_images', action='store_true',
+                    help='Also write frames rendered in memory with '
+                         '--pipeline to disk, for debugging.')
+parser.add_argument('--backend', default='moviepy', choices=stitch.BACKENDS,
+                    help='Video muxing backend.')
+parser.add_argument('--still_frames', action='store_true',
+                    help='Encode each image once with its duration, '
+                         'requires the ffmpeg backend.')
+parser.add_argument('--workers', default=1, type=int,
+                    help='Number of segments to render in parallel.')
+parser.add_argument('--tts_backend', default='pyttsx3',
+                    choices=backends.BACKENDS,
+                    help='Text to speech backend, espeak-ng runs on Linux '
+                         'without platform voices.')
+parser.add_argument('--tts_workers', default=0, type=int,
+                    help='Number of text to speech engine processes per '
+                         'segment, zero synthesizes in process.')
+parser.add_argument('--tts_jobs_per_engine',
+                    default=backends.JOBS_PER_ENGINE, type=int,
+                    help='Sentences a pyttsx3 engine synthesizes before it '
+                         'is recycled, 1 works around drivers that hang. '
+                         'espeak-ng engines are never recycled.')
+parser.add_argument('--speech_cache', default='_cache/speech',
+                    help='Directory of the speech cache, empty to disable.')
+parser.add_argument('--speech_cache_size', default=2048, type=int,
+                    help='Maximum size of the speech cache in megabytes.')
+parser.add_argument('--frame_cache', default='_cache/frames',
+                    help='Directory of the rendered frame cache, empty to '
+                         'disable. Only used for frames written to disk, '
+                         'frames kept in memory with --pipeline are only '
+                         'cached with --save_images.')
+parser.add_argument('--frame_cache_size', default=4096, type=int,
+                    help='Maximum size of the frame cache in megabytes.')
+parser.add_argument('--duck_music', action='store_true',
+                    help='Lower the background music under speech.')
+parser.add_argument('--reddit_store', default='_cache/reddit.db',
+                    help='Database of stored submissions, empty to '
+                         'disable.')
+parser.add_argument('--offline', action='store_true',
+                    help='Only use submissions from the reddit store.')
+parser.add_argument('--pipeline', action='store_true',
+                    help='Stream sentences through rendering, speech and '
+                         'encoding instead of running one stage at a time.')
+parser.add_argument('--report', default='',
+                    help='Write a JSON report of the time, memory and output '
+                         'of every stage to this file.')
+parser.add_argument('--trace', default='',
+                    help='Write a Chrome trace of every stage to this file.')
 
 
 WIDTH = 1920
 HEIGHT = 1080
+FPS = 2
 
+# Voice bots of this process by rate delta and number of engine processes,
+# shared by every segment and episode so engines are started only once.
+_VOICE_BOTS = {}
 
-def main():
-    # Load in config file.
-    with open(args.config) as f:
-        config = json.load(f)["config"]
 
-    # Instantiate a video stitcher.
-    stitcher = stitch.Stitcher(
-        filepath="_tmp/video",
-        fps=2,
-        width=WIDTH,
-        height=HEIGHT
+def get_instrument_directory(options):
+    """Get where every process records its stages when instrumented."""
+    return options["output"] + "/instrument"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_cache(cache_class, filepath, max_bytes):
+    """Get a cache, shared by every episode made in this process."""
+    return cache_class(filepath=filepath, max_bytes=max_bytes)
+
+
+def get_speech_cache(options):
+    """Get the speech cache configured on the command line, if any."""
+    if not options["speech_cache"]:
+        return None
+    return _get_cache(
+        speech_cache.SpeechCache, options["speech_cache"],
+        options["speech_cache_size"] * 1024 ** 2
     )
 
-    # Iterate through the config.
-    for i, segment in enumerate(config):
-        # Extract content from url.
-        URL = segment["url"]
-        content_generator = r.ContentGenerator(url=URL)
 
-        # Tokenize submission
-        submission = content_generator.submission
-        text_list = [submission.title]
-        text_list.extend(utils.tokenize(submission.selftext))
+def get_frame_cache(options):
+    """Get the rendered frame cache configured on the command line, if any."""
+    if not options["frame_cache"]:
+        return None
+    return _get_cache(
+        cache.FileCache, options["frame_cache"],
+        options["frame_cache_size"] * 1024 ** 2
+    )
+
 
-        # Generate images and audio.
-        text_to_image = im.render_submission(
+def get_voice_bot(options, rate_delta, workers=0):
+    """Get a voice bot configured on the command line.
+
+    Voice bots are kept for the life of the process, so their engines and
+    engine processes are reused by every segment and episode.
+    Args:
+        options: Dictionary of the parsed command line arguments.
+        rate_delta: Amount to add to the default voice rate.
+        workers: Number of engine processes, zero synthesizes in process.
+    Returns:
+        The voice bot.
+    """
+    key = (rate_delta, workers)
+    if key not in _VOICE_BOTS:
+        _VOICE_BOTS[key] = speech.VoiceBot(
+            rate_delta=rate_delta,
+            workers=workers,
+            jobs_per_engine=options["tts_jobs_per_engine"],
+            cache=get_speech_cache(options),
+            backend=options["tts_backend"]
+        )
+    return _VOICE_BOTS[key]
+
+
+def close_voice_bots():
+    """Stop the engines of every voice bot of this process."""
+    for vb in _VOICE_BOTS.values():
+        vb.close()
+    _VOICE_BOTS.clear()
+
+
+def segment_label(i, options):
+    """Label of a segment in the instrumentation, unique across episodes."""
+    if not options["episode"]:
+        return i
+    return "%s/%d" % (options["episode"], i)
+
+
+def get_reddit_store(options):
+    """Get the submission store configured on the command line, if any."""
+    if not options["reddit_store"]:
+        return None
+    return store.SubmissionStore(
+        filename=options["reddit_store"], offline=options["offline"]
+    )
+
+
+def render_frames(segment, submission, comment_chains, filepath, options):
+    """Render the frames of a segment lazily.
+
+    Frames are kept in memory only when streamed with --pipeline, where
+    just the frames in flight are alive at once. Otherwise every sentence
+    is held until the segment is stitched, so frames are written to disk
+    and sentences hold their filenames.
+    Args:
+        segment: Config entry describing the segment.
+        submission: Submission of the segment.
+        comment_chains: Comment chains shown after the submission.
+        filepath: Where to store frames if saving images.
+        options: Dictionary of the parsed command line arguments.
+    Yields:
+        Sentences of the submission then of the comment chains, with their
+        image set.
+    """
+    in_memory = options["pipeline"]
+    count = 0
+    for sentence in im.render_submission(
             submission=submission,
             text_font_size=42,
             text_font=segment["text_font"],
             image_max_length=WIDTH,
             image_max_height=HEIGHT,
-            filepath="_tmp/images_%s" % str(i),
+            filepath=filepath,
             title_font=segment["title_font"],
-            title_size=60
+            title_size=60,
+            in_memory=in_memory,
+            save_images=options["save_images"],
+            cache=get_frame_cache(options),
+            lazy=True):
+        count += 1
+        yield sentence
+    if comment_chains:
+        yield from im.render_comment_chains(
+            comment_chains=comment_chains,
+            filepath=filepath,
+            font_size=42,
+            font=segment["text_font"],
+            image_max_length=WIDTH,
+            image_max_height=HEIGHT,
+            in_memory=in_memory,
+            save_images=options["save_images"],
+            cache=get_frame_cache(options),
+            first_index=count,
+            lazy=True
         )
-        vb = speech.VoiceBot(rate_delta=segment["rate_delta"])
-        text_to_speech = vb.generate_speech_files(
-            text_list=text_list,
-            filepath="_tmp/audio_%s" % str(i),
-            submission=submission,
-            include_intro=segment["include_intro"]
+
+
+def get_build_key(segment, submission, comment_chains, options) -> str:
+    """Hash everything that goes into a segment video.
+
+    Args:
+        segment: Config entry describing the segment.
+        submission: Submission of the segment.
+        comment_chains: Comment chains following the submission.
+        options: Dictionary of the parsed command line arguments.
+    Returns:
+        Key that changes whenever the segment would be rendered differently.
+    """
+    return utils.hash_inputs(
+        segment, submission.title, submission.selftext, submission.score,
+        str(submission.author),
+        [[(str(comment.author), comment.score, comment.body)
+          for comment in chain] for chain in comment_chains],
+        utils.file_fingerprint(segment["text_font"]),
+        utils.file_fingerprint(segment["title_font"]), FPS, WIDTH, HEIGHT,
+        options["backend"], options["still_frames"], options["tts_backend"],
+        [utils.file_fingerprint(filename) for filename in
+         lexicon.lexicon_filenames(submission.subreddit.display_name)]
+    )
+
+
+def render_segment(i, segment, options, submission=None):
+    """Render a single config segment into a video.
+
+    Every segment works in its own directory of the episode's working
+    directory so segments can be rendered concurrently in separate
+    processes. A segment whose inputs hash to the same key as its previous
+    build is not rendered again.
+    Args:
+        i: Index of the segment in the config.
+        segment: Config entry describing the segment. An optional
+            comment_chains entry holds the arguments of
+            get_curated_comment_chains, the chains follow the submission.
+        options: Dictionary of the parsed command line arguments.
+        submission: Already fetched submission of the segment, if any.
+    Returns:
+        Dictionary with the filename, duration and speech spans of the
+        segment video.
+    """
+    segment_filepath = options["workdir"] + "/segment_%s" % str(i)
+    label = segment_label(i, options)
+    stitcher = stitch.Stitcher(
+        filepath=segment_filepath + "/video",
+        fps=FPS,
+        width=WIDTH,
+        height=HEIGHT,
+        backend=options["backend"],
+        still_frames=options["still_frames"]
+    )
+
+    # Extract content from url.
+    URL = segment["url"]
+    content_generator = r.ContentGenerator(url=URL, submission=submission)
+
+    # Curate comment chains to follow the submission, if configured.
+    submission = content_generator.submission
+    comment_chains = []
+    if segment.get("comment_chains"):
+        comment_chains = content_generator.get_curated_comment_chains(
+            **segment["comment_chains"]
         )
 
-        # Make video.
-        stitcher.stitch(text_list, text_to_image, text_to_speech)
+    # Skip the segment if nothing that goes into it changed.
+    build_key = get_build_key(segment, submission, comment_chains, options)
+    build_filename = segment_filepath + "/build.json"
+    if os.path.exists(build_filename):
+        with open(build_filename) as f:
+            build = json.load(f)
+        if build["key"] == build_key and os.path.exists(build["video"]):
+            return build
 
-    # Compile all videos and add background music.
-    stitcher.compile_all_videos(
-        include_outro=True,
-        voice_bot=vb
+    # Generate images, the renderer splits the text into sentences, then
+    # audio for every sentence, then the video.
+    sentences = instrument.timed_iter(
+        render_frames(
+            segment, submission, comment_chains,
+            segment_filepath + "/images", options
+        ),
+        "render", label
+    )
+    vb = get_voice_bot(
+        options, segment["rate_delta"], workers=options["tts_workers"]
+    )
+    if options["pipeline"]:
+        # Render frames in a background thread, synthesize speech as frames
+        # arrive and encode every sentence as soon as both are ready. The
+        # speech span includes the time spent waiting for frames.
+        with instrument.span(
+                "stitch", label, output=stitcher.filepath) as record:
+            stitcher.stitch(instrument.timed_iter(
+                vb.iter_speech_files(
+                    sentences=pipeline.iter_in_thread(sentences),
+                    filepath=segment_filepath + "/audio",
+                    submission=submission,
+                    include_intro=segment["include_intro"]
+                ),
+                "speech", label
+            ))
+            record.items = len(stitcher.speech_spans[0])
+    else:
+        sentences = list(sentences)
+        with instrument.span(
+                "speech", label,
+                output=segment_filepath + "/audio") as record:
+            vb.generate_speech_files(
+                sentences=sentences,
+                filepath=segment_filepath + "/audio",
+                submission=submission,
+                include_intro=segment["include_intro"]
+            )
+            record.items = len(sentences)
+        with instrument.span(
+                "stitch", label, output=stitcher.filepath) as record:
+            stitcher.stitch(sentences)
+            record.items = len(sentences)
+    build = {
+        "key": build_key,
+        "video": stitcher.videos[0],
+        "duration": stitcher.durations[0],
+        "speech_spans": stitcher.speech_spans[0]
+    }
+    with open(build_filename, "w") as f:
+        json.dump(build, f)
+    return build
+
+
+def instrumented_render_segment(i, segment, options, submission=None):
+    """Render a single config segment, recording its stages if requested.
+
+    Args:
+        i: Index of the segment in the config.
+        segment: Config entry describing the segment.
+        options: Dictionary of the parsed command line arguments.
+        submission: Already fetched submission of the segment, if any.
+    Returns:
+        Dictionary with the filename, duration and speech spans of the
+        segment video.
+    """
+    if options["report"] or options["trace"]:
+        instrument.enable(get_instrument_directory(options))
+    with instrument.span(
+            "segment", segment_label(i, options),
+            output=options["workdir"] + "/segment_%s" % str(i)):
+        return render_segment(i, segment, options, submission)
+
+
+def get_episodes(options):
+    """List the episodes to make, one per config.
+
+    A single --config is made in the working directory itself, every config
+    of a batch in a directory named after the config in it.
+    Args:
+        options: Dictionary of the parsed command line arguments.
+    Returns:
+        List of dictionaries with the name, config filename, config and
+        options of every episode.
+    """
+    if options["configs"]:
+        filenames = []
+        for pattern in options["configs"]:
+            for filename in sorted(glob.glob(pattern)) or [pattern]:
+                if filename not in filenames:
+                    filenames.append(filename)
+        names = [
+            "%s_%s" % (
+                os.path.basename(os.path.dirname(os.path.abspath(filename))),
+                os.path.splitext(os.path.basename(filename))[0]
+            ) for filename in filenames
+        ]
+        workdirs = [os.path.join(options["output"], name) for name in names]
+    else:
+        filenames, names = [options["config"]], [""]
+        workdirs = [options["output"]]
+
+    episodes = []
+    for filename, name, workdir in zip(filenames, names, workdirs):
+        # Load in config file.
+        with open(filename) as f:
+            config = json.load(f)["config"]
+        episodes.append({
+            "name": name,
+            "filename": filename,
+            "config": config,
+            "options": dict(options, workdir=workdir, episode=name),
+            "key": utils.hash_inputs(
+                config, options["backend"], options["still_frames"],
+                options["tts_backend"], options["duck_music"]
+            )
+        })
+    return episodes
+
+
+def is_episode_complete(episode):
+    """Whether an episode was already made from the same config."""
+    filename = episode["options"]["workdir"] + "/episode.json"
+    if not os.path.exists(filename):
+        return False
+    with open(filename) as f:
+        done = json.load(f)
+    return done["key"] == episode["key"] and os.path.exists(done["video"])
+
+
+def render_episode_segments(episode, submissions, executor=None):
+    """Start rendering the segments of an episode.
+
+    Args:
+        episode: Episode, as listed by get_episodes.
+        submissions: Already fetched submission of every segment, None for
+            those to fetch while rendering.
+        executor: Process pool shared by every episode, None to render in
+            this process once the builds are asked for.
+    Returns:
+        Function returning the builds of the segments in config order, it
+        blocks until they are rendered.
+    """
+    config = episode["config"]
+    render_args = (
+        range(len(config)), config, [episode["options"]] * len(config),
+        submissions
     )
-    stitcher.add_background_music(
-        volume_delta=-30
+    if executor is None:
+        return lambda: list(map(instrumented_render_segment, *render_args))
+    futures = list(map(
+        functools.partial(executor.submit, instrumented_render_segment),
+        *render_args
+    ))
+    return lambda: [future.result() for future in futures]
+
+
+def finish_episode(episode, get_builds):
+    """Compile the segments of an episode and add background music.
+
+    Args:
+        episode: Episode, as listed by get_episodes.
+        get_builds: Function returning the builds of the segments.
+    Returns:
+        Filename of the finished video.
+    """
+    options = episode["options"]
+    label = options["episode"] or None
+
+    # Instantiate a video stitcher.
+    stitcher = stitch.Stitcher(
+        filepath=options["workdir"] + "/video",
+        fps=FPS,
+        width=WIDTH,
+        height=HEIGHT,
+        backend=options["backend"],
+        still_frames=options["still_frames"]
     )
+    for build in get_builds():
+        stitcher.add_video(
+            build["video"], build.get("duration"), build.get("speech_spans")
+        )
+
+    # Compile all videos and add background music.
+    vb = get_voice_bot(options, episode["config"][-1]["rate_delta"])
+    with instrument.span(
+            "compile", label,
+            output=stitcher.filepath + "/composite_video.mp4") as record:
+        stitcher.compile_all_videos(
+            include_outro=True,
+            voice_bot=vb
+        )
+        record.items = len(stitcher.videos)
+    final_video_filename = stitcher.filepath + "/composite_video_bg.mp4"
+    with instrument.span("music", label, output=final_video_filename):
+        stitcher.add_background_music(
+            volume_delta=-30,
+            duck=options["duck_music"]
+        )
+
+    # Mark the episode done, a crash never leaves a partial marker behind.
+    filename = options["workdir"] + "/episode.json"
+    with open(filename + ".part", "w") as f:
+        json.dump({"key": episode["key"], "video": final_video_filename}, f)
+    os.replace(filename + ".part", filename)
+    return final_video_filename
+
+
+def main():
+    args = parser.parse_args()
+    if args.still_frames and args.backend != "ffmpeg":
+        parser.error("--still_frames requires --backend ffmpeg.")
+    if args.offline and not args.reddit_store:
+        parser.error("--offline requires --reddit_store.")
+    if not args.config and not args.configs:
+        parser.error("Either --config or --configs is required.")
+    options = vars(args)
+    episodes = get_episodes(options)
+    names = [episode["name"] for episode in episodes]
+    collisions = sorted(set(
+        name for name in names if names.count(name) > 1
+    ))
+    if collisions:
+        parser.error("Episode names collide: %s. Episodes are named "
+                     "<directory>_<config>, rename one of the configs."
+                     % ", ".join(collisions))
+
+    # Record the stages of this run only, from every process.
+    instrument_directory = get_instrument_directory(options)
+    if args.report or args.trace:
+        if os.path.exists(instrument_directory):
+            shutil.rmtree(instrument_directory)
+        instrument.enable(instrument_directory)
+
+    # Resume a batch where it left off.
+    if args.configs:
+        for episode in episodes:
+            if is_episode_complete(episode):
+                print("Skipping completed episode %s." % episode["name"])
+        episodes = [
+            episode for episode in episodes
+            if not is_episode_complete(episode)
+        ]
+
+    # Every submission of the batch is fetched in one batched request,
+    # stored submissions are served from the store without any request.
+    urls = [
+        segment["url"] for episode in episodes
+        for segment in episode["config"]
+    ]
+    reddit_store = get_reddit_store(options)
+    with instrument.span("fetch") as record:
+        if reddit_store is not None:
+            submissions = reddit_store.get_submissions_from_urls(urls)
+            reddit_store.close()
+        elif args.workers > 1:
+            # Praw submissions do not survive pickling, every worker process
+            # fetches its own through the shared reddit instance of that
+            # process.
+            submissions = [None] * len(urls)
+        else:
+            submissions = ru.get_submissions_from_urls(
+                urls, reddit=ru.get_reddit_instance()
+            )
+        record.items = len(urls)
+
+    # Render the segments, in parallel if requested. Every segment of the
+    # batch is queued up front on one pool, so workers, and the fonts,
+    # engines and caches they loaded, carry on with the next episode while
+    # this process compiles the previous one. Results come back in config
+    # order regardless of which segment finishes first.
+    executor = None
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+    failed = []
+    try:
+        builds, start = [], 0
+        for episode in episodes:
+            end = start + len(episode["config"])
+            builds.append(render_episode_segments(
+                episode, submissions[start:end], executor
+            ))
+            start = end
+        for episode, get_builds in zip(episodes, builds):
+            try:
+                print("Finished %s." % finish_episode(episode, get_builds))
+            except Exception:
+                # Carry on with the rest of the batch, the failed episode is
+                # made again on the next run.
+                if not args.configs:
+                    raise
+                traceback.print_exc()
+                failed.append(episode["name"])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        close_voice_bots()
+
+    if args.report:
+        instrument.write_report(instrument_directory, args.report)
+    if args.trace:
+        instrument.write_chrome_trace(instrument_directory, args.trace)
+    if failed:
+        raise RuntimeError("Failed to make episodes %s." % ", ".join(failed))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()